@@ -21,15 +21,21 @@ interface Authors {
   author_name: string;
 }
 
+interface BookFacets {
+  genres: [string, number][];
+  authors: [string, number][];
+}
+
 interface filterByBooks {
   onClose: () => void;
   onApplyFilters: (filters: any) => void; 
   books: Book[];
   authors: Authors[];
   genres: Genres[];
+  facets: BookFacets;
 }
 
-const FilterPopUp: React.FC<filterByBooks> = ({ onClose, onApplyFilters, books, authors, genres }) => {
+const FilterPopUp: React.FC<filterByBooks> = ({ onClose, onApplyFilters, books, authors, genres, facets }) => {
     useEffect(() => {
         const handleEscapeKeyPress = (event: KeyboardEvent) => {
           if (event.key === 'Escape') {
@@ -44,8 +50,13 @@ const FilterPopUp: React.FC<filterByBooks> = ({ onClose, onApplyFilters, books,
         };
       }, [onClose]);
 
+  // number of books each genre/author has under the filters currently applied
+  const genreCounts = new Map(facets.genres);
+  const authorCounts = new Map(facets.authors);
+
   const [filters, setFilters] = useState<any>({
     bookName: '',
+    titlePrefix: '',
     authorName: '',
     genres: [],
     avg_rating: '',
@@ -99,7 +110,7 @@ const FilterPopUp: React.FC<filterByBooks> = ({ onClose, onApplyFilters, books,
           className="border border-gray-300 text-center rounded-md px-3 py-2 mb-2 w-full font-serif text-black">
             <option value="" disabled>Select Author</option>
             {authors.map(author => (
-              <option key={author.authorID} value={author.author_name}>{author.author_name}</option>
+              <option key={author.authorID} value={author.author_name}>{author.author_name} ({authorCounts.get(author.author_name) || 0})</option>
             ))}
           </select>
           </div>
@@ -116,6 +127,10 @@ const FilterPopUp: React.FC<filterByBooks> = ({ onClose, onApplyFilters, books,
             ))}
           </select>
           </div>
+        <div className="mb-4">
+          <label htmlFor="titlePrefix" className="block text-white text-sm font-bold mb-2">Title starts with:</label>
+          <input type="text" name="titlePrefix" value={filters.titlePrefix} onChange={handleInputChange} className="border border-gray-300 text-center rounded-md px-3 py-2 mb-2 w-full font-serif text-black" />
+        </div>
         <div className="mb-4">
           <label className="block text-white text-sm font-bold mb-2">
             Genre: 
@@ -131,7 +146,7 @@ const FilterPopUp: React.FC<filterByBooks> = ({ onClose, onApplyFilters, books,
                   onChange={handleCheckboxChange}
                   className="form-checkbox h-5 w-5 text-emerald-600"
                 />
-                <span className="ml-2 text-white">{genre.genre_name}</span>
+                <span className="ml-2 text-white">{genre.genre_name} ({genreCounts.get(genre.genre_name) || 0})</span>
               </label>
             </div>
           ))}  
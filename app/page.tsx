@@ -45,6 +45,12 @@ interface Authors {
   author_name: string;
 }
 
+// [name, number of books] pairs for the current book filters
+interface BookFacets {
+  genres: [string, number][];
+  authors: [string, number][];
+}
+
 export default function Home() {
   const [users, setUsers] = useState<Users[]>([]);
   const [books, setBooks] = useState<Books[]>([]);
@@ -60,6 +66,13 @@ export default function Home() {
   const [isUserEditPopupOpen, setIsUserEditPopupOpen] = useState(false);
   const [isFilterPopupOpen, setIsFilterPopupOpen] = useState(false);
   const [showMessage, setshowMessage] = useState(false);
+  const [usersCursor, setUsersCursor] = useState<string | null>(null);
+  const [booksCursor, setBooksCursor] = useState<string | null>(null);
+  const [reviewsCursor, setReviewsCursor] = useState<string | null>(null);
+  const [genresCursor, setGenresCursor] = useState<string | null>(null);
+  const [authorsCursor, setAuthorsCursor] = useState<string | null>(null);
+  const [bookFilters, setBookFilters] = useState<any>({});
+  const [bookFacets, setBookFacets] = useState<BookFacets>({ genres: [], authors: [] });
 
   useEffect(() => {
     fetchUsers();
@@ -69,18 +82,65 @@ export default function Home() {
     fetchAuthors();
   }, []);
 
+  // PAGING
+  // list routes return one page at a time; the cursor for the next page comes
+  // back in the X-Next-Cursor header and is missing on the last page
+  const PAGE_SIZE = 50;
+
+  // list routes can send pages column by column, with repeated names (authors,
+  // genres) sent once and referenced by position; the browser already handles
+  // the gzip that large responses come back with
+  const COLUMNAR = 'application/vnd.plantyourbooks.columnar+json';
+  const USE_COLUMNAR = true;
+
+  const fromColumns = (page: any) => {
+    const columns = page.columns.map((column: any) =>
+      Array.isArray(column) ? column : column.index.map((i: number) => column.values[i]));
+    return Array.from({ length: page.rows }, (_, row) => columns.map((column: any[]) => column[row]));
+  };
+
+  const decodePage = (data: any) => {
+    if (data && data.columns) {
+      return fromColumns(data);
+    }
+    if (data && data.books && data.books.columns) {
+      return { ...data, books: fromColumns(data.books) };
+    }
+    return data;
+  };
+
+  const fetchPage = async (url: string, cursor: string | null = null, params: any = {}) => {
+    const resp = await axios.get(url, {
+      params: { ...params, limit: PAGE_SIZE, ...(cursor ? { cursor } : {}) },
+      headers: USE_COLUMNAR ? { Accept: COLUMNAR } : {}
+    });
+    return { rows: decodePage(resp.data), nextCursor: resp.headers['x-next-cursor'] || null };
+  };
+
+  const renderLoadMore = (cursor: string | null, onLoadMore: () => void) => (
+    cursor && (
+      <button
+        onClick={onLoadMore}
+        className="mt-2 py-1 px-4 border border-gray-400 rounded-md bg-white text-gray-800 hover:bg-gray-100 transition duration-300"
+      >
+        Load more
+      </button>
+    )
+  );
+
   // USERS
-  const fetchUsers = async () => {
+  const fetchUsers = async (cursor: string | null = null) => {
   try {
-  const resp = await axios.get<Users[]>('http://localhost:5001/api/users');
-  const mappedUsers: Users[] = resp.data.map((usersData: any) => ({
+  const page = await fetchPage('http://localhost:5001/api/users', cursor);
+  const mappedUsers: Users[] = page.rows.map((usersData: any) => ({
     userID: usersData[0],
     username: usersData[1],
     email: usersData[2],
     join_date: usersData[3],
     bio: usersData[4],
   }));
-  setUsers(mappedUsers);
+  setUsers(prev => cursor ? [...prev, ...mappedUsers] : mappedUsers);
+  setUsersCursor(page.nextCursor);
   } catch (error) {
     console.error('Error fetching users:', error);
   }
@@ -111,10 +171,12 @@ const handleEditUser = async (editedUser: Users) => {
 };
 
 //BOOKS 
-const fetchBooks = async () => {
+// facets=1 returns { books, facets } so the filter panel's genre and author
+// counts come back with the first page instead of needing their own request
+const fetchBooks = async (cursor: string | null = null, filters: any = bookFilters) => {
   try {
-    const resp = await axios.get<Books[]>('http://localhost:5001/api/books');
-    const mappedBooks: Books[] = resp.data.map((booksData: any) => ({
+    const page = await fetchPage('http://localhost:5001/api/books', cursor, { ...filters, facets: 1 });
+    const mappedBooks: Books[] = page.rows.books.map((booksData: any) => ({
       bookID: booksData[0],
       bookName: booksData[1],
       authorName: booksData[2], 
@@ -123,7 +185,11 @@ const fetchBooks = async () => {
       avg_rating: booksData[5] || 0,
       num_rating: booksData[6] || 0
     }));
-    setBooks(mappedBooks);
+    setBooks(prev => cursor ? [...prev, ...mappedBooks] : mappedBooks);
+    setBooksCursor(page.nextCursor);
+    if (page.rows.facets) {
+      setBookFacets(page.rows.facets);
+    }
   } catch (error) {
     console.error('Error fetching books:', error);
   }
@@ -149,7 +215,8 @@ console.log(books);
 
   const handleResetFilters = async () => {
     try {
-      await fetchBooks();
+      setBookFilters({});
+      await fetchBooks(null, {});
       setshowMessage(false);
     } catch (error) {
       console.error('Error fetching books:', error);
@@ -159,19 +226,8 @@ console.log(books);
   const handleApplyFilters = async (filters: any) => {
     try {
       console.log(filters);
-      const response = await axios.get('http://localhost:5001/api/books', {
-        params: filters
-      });
-      const mappedBooks = response.data.map((booksData:any) => ({
-        bookID: booksData[0],
-        bookName: booksData[1],
-        authorName: booksData[2], 
-        genreName: booksData[3],
-        synopsis: booksData[4],
-        avg_rating: booksData[5],
-        num_rating: booksData[6]
-      }));
-      setBooks(mappedBooks);
+      setBookFilters(filters);
+      await fetchBooks(null, filters);
       setshowMessage(true);
     } catch (error) {
       console.error('Error fetching filtered books:', error);
@@ -179,11 +235,11 @@ console.log(books);
   };
 
   //REVIEWS 
-  const fetchReviews = async () => {
+  const fetchReviews = async (cursor: string | null = null) => {
     try {
-      const resp = await axios.get<Reviews[]>('http://localhost:5001/api/reviews');
-      console.log(resp.data);
-      const mappedReviews: Reviews[] = resp.data.map((reviewsData: any) => ({
+      const page = await fetchPage('http://localhost:5001/api/reviews', cursor);
+      console.log(page.rows);
+      const mappedReviews: Reviews[] = page.rows.map((reviewsData: any) => ({
         reviewID: reviewsData[0],
         bookName: reviewsData[2], 
         userName: reviewsData[1],
@@ -191,7 +247,8 @@ console.log(books);
         review: reviewsData[4],
         review_date: reviewsData[5],
       }));
-      setReviews(mappedReviews);
+      setReviews(prev => cursor ? [...prev, ...mappedReviews] : mappedReviews);
+      setReviewsCursor(page.nextCursor);
     } catch (error) {
       console.error('Error fetching reviews:', error);
     }
@@ -206,14 +263,15 @@ console.log(books);
   };
  
   //GENRES
-  const fetchGenres = async () => {
+  const fetchGenres = async (cursor: string | null = null) => {
     try {
-      const resp = await axios.get<Genres[]>('http://localhost:5001/api/genres');
-      const mappedGenres: Genres[] = resp.data.map((genresData: any) => ({
+      const page = await fetchPage('http://localhost:5001/api/genres', cursor);
+      const mappedGenres: Genres[] = page.rows.map((genresData: any) => ({
         genreID: genresData[0],
         genre_name: genresData[1], 
       }));
-      setGenres(mappedGenres);
+      setGenres(prev => cursor ? [...prev, ...mappedGenres] : mappedGenres);
+      setGenresCursor(page.nextCursor);
     } catch (error) {
       console.error('Error fetching genres:', error);
     }
@@ -228,14 +286,15 @@ console.log(books);
   };
 
   //AUTHORS
-  const fetchAuthors = async () => {
+  const fetchAuthors = async (cursor: string | null = null) => {
     try {
-      const resp = await axios.get<Authors[]>('http://localhost:5001/api/authors');
-      const mappedAuthors: Authors[] = resp.data.map((authorsData: any) => ({
+      const page = await fetchPage('http://localhost:5001/api/authors', cursor);
+      const mappedAuthors: Authors[] = page.rows.map((authorsData: any) => ({
         authorID: authorsData[0],
         author_name: authorsData[1], 
       }));
-      setAuthors(mappedAuthors);
+      setAuthors(prev => cursor ? [...prev, ...mappedAuthors] : mappedAuthors);
+      setAuthorsCursor(page.nextCursor);
     } catch (error) {
       console.error('Error fetching authors:', error);
     }
@@ -447,7 +506,7 @@ return (
         />
         }
       {isFilterPopupOpen && 
-        <FilterPopUp onClose={handleCloseFilterPopup} onApplyFilters={handleApplyFilters} books={books} authors={authors} genres={genres} />
+        <FilterPopUp onClose={handleCloseFilterPopup} onApplyFilters={handleApplyFilters} books={books} authors={authors} genres={genres} facets={bookFacets} />
       }
   
   <div className="container">
@@ -498,6 +557,7 @@ return (
       </div>
     </li>
   </ul>
+  {renderLoadMore(usersCursor, () => fetchUsers(usersCursor))}
 </div>
 
 <div className="container">
@@ -522,6 +582,7 @@ return (
       </div>
     </li>
   </ul>
+  {renderLoadMore(genresCursor, () => fetchGenres(genresCursor))}
 </div>
 <div className="container">
   <h1 className="text-4xl mb-2 text-white font-reenie">Authors</h1>
@@ -554,6 +615,7 @@ return (
       </div>
     </li>
   </ul>
+  {renderLoadMore(authorsCursor, () => fetchAuthors(authorsCursor))}
 </div>
 
 <div className="container">
@@ -634,6 +696,7 @@ return (
       </div>
     </li>
   </ul>
+  {renderLoadMore(booksCursor, () => fetchBooks(booksCursor))}
 </div>
 
 <div className="container">
@@ -687,6 +750,7 @@ return (
       </div>
     </li>
   </ul>
+  {renderLoadMore(reviewsCursor, () => fetchReviews(reviewsCursor))}
 </div>
       </div>
 );
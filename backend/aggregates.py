@@ -0,0 +1,39 @@
+import argparse
+import sqlite3
+
+# helpers shared by the trigger-maintained tables (book_stats, book_search,
+# leaderboards): comparing stored aggregates with recomputed ones, and the
+# command line each module offers to rebuild or verify its table.
+
+
+def close(a, b):
+    # stored and recomputed averages may differ in the last bits
+    if a is None or b is None:
+        return a is None and b is None
+    return abs(a - b) < 1e-9
+
+
+def run_cli(description, ensure, rebuild, verify, rebuild_command='rebuild', counting='books'):
+    # rebuild(c) returns the line to print; verify(c) returns one line per
+    # mismatch. verify exits with status 1 when anything is out of step
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument('command', choices=[rebuild_command, 'verify'])
+    parser.add_argument('--db', default='backend/database.db')
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db, isolation_level=None)
+    c = conn.cursor()
+    c.execute("BEGIN")
+    ensure(c)
+    if args.command == rebuild_command:
+        print(rebuild(c))
+        mismatches = []
+    else:
+        mismatches = verify(c)
+        for line in mismatches:
+            print(line)
+        print(f"{len(mismatches)} mismatched {counting}")
+    c.execute("COMMIT")
+    conn.close()
+    if mismatches:
+        raise SystemExit(1)
@@ -0,0 +1,290 @@
+import asyncio
+import io
+import os
+import sqlite3
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import main
+from migrations import migrate
+
+# ASGI entry point for production serving (see serve.py for the launcher).
+#
+# the flask routes and sqlite3 are blocking, so the event loop never runs them
+# directly: it reads the request, hands the whole WSGI call to a bounded thread
+# pool sized to the connection pool, and writes the response back as the worker
+# produces it. one request stays on one worker thread from start to finish,
+# because the pool's connections are checked out per thread.
+#
+# backpressure: at most MAX_PENDING requests may wait for a worker; past that
+# the server answers 503 with Retry-After straight from the event loop, without
+# touching sqlite. a slow client pauses its worker once STREAM_BUFFER chunks are
+# queued, so streamed exports never buffer more than that.
+#
+# with several worker processes (ASGI_WORKERS > 1, set by serve.py) each one has
+# its own pool and response cache, so the cache also watches PRAGMA data_version
+# and drops everything when any connection to the file commits.
+
+WORKER_THREADS = int(os.environ.get('ASGI_THREADS', main.pool.max_connections))
+MAX_PENDING = int(os.environ.get('ASGI_MAX_PENDING', 64))
+MAX_BODY = int(os.environ.get('ASGI_MAX_BODY', 64 * 1024 * 1024))
+STREAM_BUFFER = 8
+WORKERS = int(os.environ.get('ASGI_WORKERS', 1))
+
+
+class Overloaded(Exception):
+    pass
+
+
+class ClientGone(Exception):
+    pass
+
+
+class BlockingOffload:
+    # runs blocking work on a bounded thread pool; callers beyond the pending
+    # limit are turned away instead of piling up
+    def __init__(self, workers, max_pending):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='sqlite')
+        self.max_pending = max_pending
+        self._slots = asyncio.Semaphore(workers)
+        self._waiting = 0
+        self.rejected = 0
+
+    async def run(self, fn, *args):
+        if self._slots.locked():
+            if self._waiting >= self.max_pending:
+                self.rejected += 1
+                raise Overloaded()
+            self._waiting += 1
+            try:
+                await self._slots.acquire()
+            finally:
+                self._waiting -= 1
+        else:
+            await self._slots.acquire()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+        finally:
+            self._slots.release()
+
+    def metrics(self):
+        return {"waiting": self._waiting, "max_pending": self.max_pending, "rejected": self.rejected}
+
+
+offload = None
+
+
+def _environ(scope, body):
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', ''),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'REMOTE_ADDR': client[0],
+        # the body is already buffered, so its length is known even when the
+        # client sent it chunked
+        'CONTENT_LENGTH': str(len(body)),
+        'SERVER_PROTOCOL': 'HTTP/' + scope.get('http_version', '1.1'),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name == 'CONTENT_TYPE':
+            environ['CONTENT_TYPE'] = value
+        elif name not in ('CONTENT_LENGTH', 'TRANSFER_ENCODING'):
+            key = 'HTTP_' + name
+            environ[key] = environ[key] + ',' + value if key in environ else value
+    return environ
+
+
+def _data_version(db_file):
+    # data_version changes whenever a connection other than this one commits;
+    # this connection never writes, so that means any commit at all
+    conn = sqlite3.connect(db_file, check_same_thread=False)
+    lock = threading.Lock()
+
+    def read():
+        with lock:
+            return conn.execute('PRAGMA data_version').fetchone()[0]
+    return read
+
+
+def _call_wsgi(environ, loop, queue, gone):
+    # runs on a worker thread: calls flask and feeds the response into queue,
+    # blocking whenever the event loop side hasn't caught up. gone is set when
+    # the client disconnects, which stops the response iterator early
+    def put(message):
+        asyncio.run_coroutine_threadsafe(queue.put(message), loop).result()
+        if gone.is_set():
+            raise ClientGone()
+
+    started = {}
+
+    def start_response(status, headers, exc_info=None):
+        started['status'] = int(status.split(' ', 1)[0])
+        # the ASGI server adds its own Date; the one make_conditional sets on
+        # cached responses would otherwise go out as a second header
+        started['headers'] = [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in headers
+                              if k.lower() != 'date']
+
+    try:
+        body = main.app.wsgi_app(environ, start_response)
+        try:
+            head_sent = False
+            for chunk in body:
+                if not head_sent:
+                    put(('start', started))
+                    head_sent = True
+                if chunk:
+                    put(('body', chunk))
+            if not head_sent:
+                put(('start', started))
+        finally:
+            if hasattr(body, 'close'):
+                body.close()
+    except ClientGone:
+        return
+    except Exception as e:
+        put(('error', e))
+        return
+    put(('end', None))
+
+
+async def _read_body(receive):
+    chunks, size = [], 0
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return None
+        chunk = message.get('body', b'')
+        size += len(chunk)
+        if size > MAX_BODY:
+            raise ValueError("request body too large")
+        chunks.append(chunk)
+        if not message.get('more_body', False):
+            return b''.join(chunks)
+
+
+async def _simple(send, status, body, headers=()):
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(b'content-type', b'application/json')] + list(headers)})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def _http(scope, receive, send):
+    try:
+        body = await _read_body(receive)
+    except ValueError:
+        await _simple(send, 413, b'{"error": "Request body too large"}')
+        return
+    if body is None:
+        return
+
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue(maxsize=STREAM_BUFFER)
+    environ = _environ(scope, body)
+    gone = threading.Event()
+    worker = asyncio.ensure_future(offload.run(_call_wsgi, environ, loop, queue, gone))
+    try:
+        await _relay(send, queue, worker)
+    except BaseException:
+        # the send failed or we were cancelled: let the worker run into gone,
+        # unblocking any put it is waiting on, and wait for it to let go of its
+        # connection
+        gone.set()
+        while not worker.done():
+            while not queue.empty():
+                queue.get_nowait()
+            await asyncio.sleep(0.01)
+        raise
+
+
+async def _relay(send, queue, worker):
+    while True:
+        getter = asyncio.ensure_future(queue.get())
+        done, _ = await asyncio.wait({getter, worker}, return_when=asyncio.FIRST_COMPLETED)
+        if getter not in done:
+            getter.cancel()
+            # the worker finished without queueing anything: it was rejected or crashed
+            try:
+                worker.result()
+            except Overloaded:
+                await _simple(send, 503, b'{"error": "Server busy, retry shortly"}', [(b'retry-after', b'1')])
+                return
+            if queue.empty():
+                await _simple(send, 500, b'{"error": "Internal server error"}')
+                return
+            continue
+
+        kind, value = getter.result()
+        if kind == 'start':
+            await send({'type': 'http.response.start', 'status': value['status'], 'headers': value['headers']})
+        elif kind == 'body':
+            await send({'type': 'http.response.body', 'body': value, 'more_body': True})
+        elif kind == 'end':
+            await send({'type': 'http.response.body', 'body': b''})
+            await worker
+            return
+        else:
+            await worker
+            raise value
+
+
+async def _lifespan(receive, send):
+    global offload
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            try:
+                offload = BlockingOffload(WORKER_THREADS, MAX_PENDING)
+                main.metrics.register_gauges('asgi', offload.metrics, "ASGI worker queue state.")
+                if WORKERS > 1:
+                    main.cache.version = _data_version(main.DB_FILE)
+                await offload.run(_migrate)
+                main.refresher.start()
+                main.snapshot.start()
+                main.review_queue.start()
+            except Exception as e:
+                await send({'type': 'lifespan.startup.failed', 'message': str(e)})
+                return
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            # queued reviews are committed before the thread pool goes away
+            await asyncio.get_running_loop().run_in_executor(None, main.review_queue.stop)
+            main.refresher.stop()
+            main.snapshot.stop()
+            offload.executor.shutdown(wait=True)
+            main.pool.close_all()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+_migrate_lock = threading.Lock()
+
+
+def _migrate():
+    # with several worker processes each one runs this; migrations are
+    # versioned and transactional, and busy_timeout serializes the writers
+    with _migrate_lock, main.pool.connection() as conn:
+        migrate(conn, log=None)
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        await _lifespan(receive, send)
+    elif scope['type'] == 'http':
+        if offload is None:
+            raise RuntimeError("ASGI lifespan startup has not run")
+        await _http(scope, receive, send)
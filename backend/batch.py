@@ -0,0 +1,197 @@
+import json
+from flask import request
+
+# bulk inserts for catalog imports. a batch is a JSON array, or NDJSON when the
+# body is sent as application/x-ndjson. every row is checked up front, names are
+# resolved to IDs with one lookup per batch instead of a subquery per row, and
+# the valid rows go in with a single executemany inside one transaction. rows
+# that fail are skipped and reported back by their position in the batch.
+
+NDJSON = 'application/x-ndjson'
+LOOKUP_CHUNK = 500
+
+
+def parse_batch_body():
+    # returns (items, errors) where items is a list of (index, row)
+    if request.mimetype == NDJSON:
+        items, errors = [], []
+        # rows are numbered by their line in the body, blank lines included, so
+        # error indexes point at the line the client sent
+        for index, line in enumerate(request.get_data(as_text=True).splitlines()):
+            if not line.strip():
+                continue
+            try:
+                items.append((index, json.loads(line)))
+            except ValueError as e:
+                errors.append({"index": index, "error": f"Invalid JSON: {e}"})
+        return items, errors
+
+    data = request.get_json(silent=True)
+    if not isinstance(data, list):
+        raise ValueError("Body must be a JSON array or NDJSON")
+    return list(enumerate(data)), []
+
+
+def lookup_ids(c, table, name_col, id_col, names):
+    # name -> lowest ID with that name, the same row the single-row routes pick
+    ids = {}
+    names = list(names)
+    for start in range(0, len(names), LOOKUP_CHUNK):
+        chunk = names[start:start + LOOKUP_CHUNK]
+        placeholders = ', '.join('?' for _ in chunk)
+        c.execute(f'''SELECT {name_col}, min({id_col}) FROM {table}
+                      WHERE {name_col} IN ({placeholders}) GROUP BY {name_col}''', chunk)
+        ids.update(c.fetchall())
+    return ids
+
+
+def _names(items, key):
+    return {row.get(key) for _, row in items if isinstance(row, dict) and isinstance(row.get(key), str)}
+
+
+def _user(row, lookups):
+    email = row.get('email')
+    if not isinstance(email, str) or '@' not in email:
+        raise ValueError("Invalid email format")
+    return (row.get('username'), email, row.get('join_date'), row.get('bio'))
+
+
+def _genre(row, lookups):
+    return (row.get('genre_name'),)
+
+
+def _author(row, lookups):
+    return (row.get('author_name'),)
+
+
+def _book(row, lookups):
+    authorID = lookups['authors'].get(row.get('authorName'))
+    if authorID is None:
+        raise ValueError(f"Unknown author: {row.get('authorName')}")
+    genreID = lookups['genres'].get(row.get('genreName'))
+    if genreID is None:
+        raise ValueError(f"Unknown genre: {row.get('genreName')}")
+    return (row.get('bookName'), authorID, genreID, row.get('synopsis'))
+
+
+def _review(row, lookups):
+    userID = lookups['users'].get(row.get('userName'))
+    if userID is None:
+        raise ValueError(f"Unknown user: {row.get('userName')}")
+    bookID = lookups['books'].get(row.get('bookName'))
+    if bookID is None:
+        raise ValueError(f"Unknown book: {row.get('bookName')}")
+    return (userID, bookID, row.get('rating'), row.get('review'), row.get('review_date'))
+
+
+def _book_lookups(c, items):
+    return {
+        'authors': lookup_ids(c, 'authors', 'author_name', 'authorID', _names(items, 'authorName')),
+        'genres': lookup_ids(c, 'genres', 'genre_name', 'genreID', _names(items, 'genreName')),
+    }
+
+
+def _review_lookups(c, items):
+    return {
+        'users': lookup_ids(c, 'users', 'username', 'userID', _names(items, 'userName')),
+        'books': lookup_ids(c, 'books', 'book_name', 'bookID', _names(items, 'bookName')),
+    }
+
+
+SQLITE_INT_MIN, SQLITE_INT_MAX = -2 ** 63, 2 ** 63 - 1
+
+
+def _check_params(statement, values):
+    # anything sqlite can't bind (objects, arrays, out-of-range integers) would
+    # fail the whole executemany, so it is a row error instead
+    columns = statement[statement.index('(') + 1:statement.index(')')].split(', ')
+    for column, value in zip(columns, values):
+        if value is not None and not isinstance(value, (str, int, float)):
+            raise ValueError(f"Unsupported value for {column}: expected a string, number or null")
+        if isinstance(value, int) and not SQLITE_INT_MIN <= value <= SQLITE_INT_MAX:
+            raise ValueError(f"Integer out of range for {column}")
+    return values
+
+
+# entity -> (insert statement, row -> params, batch -> name lookups)
+BATCH_INSERTS = {
+    'users': ("INSERT INTO users (username, email, join_date, bio) VALUES (?, ?, ?, ?)", _user, None),
+    'genres': ("INSERT INTO genres (genre_name) VALUES (?)", _genre, None),
+    'authors': ("INSERT INTO authors (author_name) VALUES (?)", _author, None),
+    'books': ("INSERT INTO books (book_name, authorID, genreID, synopsis) VALUES (?, ?, ?, ?)", _book, _book_lookups),
+    'reviews': ("INSERT INTO reviews (userID, bookID, rating, review, review_date) VALUES (?, ?, ?, ?, ?)", _review, _review_lookups),
+}
+
+
+def insert_batch(c, entity, items):
+    # returns (inserted count, per-row errors); c must be inside a transaction
+    statement, prepare, lookup = BATCH_INSERTS[entity]
+    lookups = lookup(c, items) if lookup else {}
+
+    params, errors = [], []
+    for index, row in items:
+        if not isinstance(row, dict):
+            errors.append({"index": index, "error": "Row must be a JSON object"})
+            continue
+        try:
+            params.append(_check_params(statement, prepare(row, lookups)))
+        except (ValueError, TypeError) as e:
+            errors.append({"index": index, "error": str(e)})
+
+    c.executemany(statement, params)
+    return len(params), errors
+
+
+# BULK DELETES
+# a delete batch is a list of IDs. dependent rows go first, each step is one
+# executemany keyed on an indexed column (reviews_user_idx, reviews_book_idx,
+# books_genre_idx, books_author_idx), so a batch costs what the rows it touches
+# cost. book_stats, book_search and the search index follow the review and book
+# deletes through their triggers.
+
+# entity -> [(table, "deleted" | "updated", statement taking one ID)]
+BATCH_DELETES = {
+    'users': [
+        ('reviews', 'deleted', "DELETE FROM reviews WHERE userID = ?"),
+        ('users', 'deleted', "DELETE FROM users WHERE userID = ?"),
+    ],
+    'books': [
+        ('reviews', 'deleted', "DELETE FROM reviews WHERE bookID = ?"),
+        ('books', 'deleted', "DELETE FROM books WHERE bookID = ?"),
+    ],
+    'reviews': [
+        ('reviews', 'deleted', "DELETE FROM reviews WHERE reviewID = ?"),
+    ],
+    # books outlive their genre or author, as with the single-row deletes
+    'genres': [
+        ('books', 'updated', "UPDATE books SET genreID = NULL WHERE genreID = ?"),
+        ('genres', 'deleted', "DELETE FROM genres WHERE genreID = ?"),
+    ],
+    'authors': [
+        ('books', 'updated', "UPDATE books SET authorID = NULL WHERE authorID = ?"),
+        ('authors', 'deleted', "DELETE FROM authors WHERE authorID = ?"),
+    ],
+}
+
+
+def parse_id_list(items):
+    # (index, value) items -> (unique IDs in order, per-item errors)
+    ids, seen, errors = [], set(), []
+    for index, value in items:
+        if isinstance(value, bool) or not isinstance(value, int):
+            errors.append({"index": index, "error": "ID must be an integer"})
+        elif value not in seen:
+            seen.add(value)
+            ids.append(value)
+    return ids, errors
+
+
+def delete_batch(c, entity, ids):
+    # returns {"deleted": {table: rows}, "updated": {table: rows}}; c must be
+    # inside a write transaction
+    counts = {"deleted": {}, "updated": {}}
+    params = [(i,) for i in ids]
+    for table, kind, statement in BATCH_DELETES[entity]:
+        c.executemany(statement, params)
+        counts[kind][table] = counts[kind].get(table, 0) + max(c.rowcount, 0)
+    return counts
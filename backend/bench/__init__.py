@@ -0,0 +1,10 @@
+# benchmark suite for the flask API. run from the backend directory:
+#
+#   python -m bench generate --db /tmp/bench.db --scale 100000
+#   python -m bench run --db /tmp/bench.db --requests 5000 --threads 4 --out before.json
+#   python -m bench compare before.json after.json
+#
+# generate fills a scratch database with deterministic synthetic data, run
+# replays a weighted request mix against the app (in-process through flask's
+# test client, or a live server with --url) and writes latency/throughput to
+# JSON, and compare diffs two of those reports.
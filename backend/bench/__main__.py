@@ -0,0 +1,49 @@
+import argparse
+import sys
+
+from bench import datagen, driver, report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m bench', description="Benchmark the PlantYourBooks API.")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    gen = commands.add_parser('generate', help="fill a scratch database with synthetic data")
+    gen.add_argument('--db', required=True)
+    gen.add_argument('--scale', type=int, default=1000, help="number of reviews (10^3 to 10^7)")
+    gen.add_argument('--seed', type=int, default=348)
+
+    run = commands.add_parser('run', help="replay the request mix and write a JSON report")
+    run.add_argument('--db', required=True, help="database to benchmark (writes go into it)")
+    run.add_argument('--url', help="benchmark a running server instead of the in-process test client")
+    run.add_argument('--requests', type=int, default=2000)
+    run.add_argument('--threads', type=int, default=4)
+    run.add_argument('--seed', type=int, default=348)
+    run.add_argument('--out', default='bench_results.json')
+
+    cmp = commands.add_parser('compare', help="compare two reports")
+    cmp.add_argument('old')
+    cmp.add_argument('new')
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'generate':
+        datagen.generate(args.db, args.scale, args.seed)
+    elif args.command == 'run':
+        catalog = driver.Catalog(args.db)
+        target = driver.HttpTarget(args.url) if args.url else driver.TestClientTarget(args.db)
+        result = driver.run(target, catalog, args.requests, args.threads, args.seed)
+        meta = {"db": args.db, "target": args.url or "test_client", "requests": args.requests,
+                "threads": args.threads, "seed": args.seed, "mix": driver.MIX}
+        summary = report.build_report(result, meta)
+        report.save(summary, args.out)
+        overall = summary["overall"]
+        print(f"{overall['count']} requests, {overall['errors']} errors, {overall['throughput_rps']} req/s, "
+              f"p50 {overall['p50_ms']} ms, p95 {overall['p95_ms']} ms, p99 {overall['p99_ms']} ms")
+        print(f"report written to {args.out}")
+    else:
+        report.compare(report.load(args.old), report.load(args.new))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,111 @@
+import os
+import random
+import sqlite3
+
+from migrations import migrate
+
+# deterministic synthetic data: the same scale and seed always give the same
+# database. scale is the number of reviews; everything else is sized from it.
+# rows are generated lazily and inserted in chunks, so 10^7 reviews never sit in
+# memory at once.
+
+GENRES = ['Fantasy', 'Romance', 'Mystery', 'Thriller', 'Science Fiction', 'Horror',
+          'Historical', 'Biography', 'Poetry', 'Young Adult', 'Classics', 'Nonfiction']
+
+WORDS = ('river lantern garden winter shadow crown letter orchard island mirror '
+         'storm whisper harbor meadow silver ember forest tide glass feather '
+         'secret journey promise kingdom memory stranger summer library ocean '
+         'quiet broken golden hidden last little lost midnight wild burning').split()
+
+FIRST_NAMES = ('Ada Basil Clara Dev Elena Farid Greta Hugo Iris Jonah Kira Leo Maya '
+               'Nina Omar Pia Quinn Rosa Sami Tess Uma Viktor Wren Yara Zane').split()
+LAST_NAMES = ('Abara Brooks Castillo Dimitrov Ellis Fujita Grant Haddad Ivers Jensen '
+              'Kowalski Lindqvist Moreau Nakamura Okafor Petrov Quispe Rahman Silva '
+              'Tanaka Underwood Vargas Whitfield Xu Young Zielinski').split()
+
+CHUNK = 10000
+
+
+def sizes(scale):
+    users = max(scale // 10, 10)
+    books = max(scale // 20, 10)
+    authors = max(books // 5, 5)
+    return {"genres": len(GENRES), "authors": authors, "books": books, "users": users, "reviews": scale}
+
+
+def _date(rng, start_year, end_year):
+    return f"{rng.randint(1, 12):02d}/{rng.randint(1, 28):02d}/{rng.randint(start_year, end_year)}"
+
+
+def _sentence(rng, low, high):
+    return ' '.join(rng.choice(WORDS) for _ in range(rng.randint(low, high)))
+
+
+def _authors(rng, n):
+    for i in range(1, n + 1):
+        yield (i, f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)} {i}")
+
+
+def _users(rng, n):
+    for i in range(1, n + 1):
+        name = f"{rng.choice(FIRST_NAMES).lower()}{i}"
+        yield (i, name, f"{name}@example.com", _date(rng, 2015, 2024), _sentence(rng, 3, 10))
+
+
+def _books(rng, n, authors):
+    for i in range(1, n + 1):
+        title = f"The {rng.choice(WORDS).title()} {rng.choice(WORDS).title()} {i}"
+        yield (i, title, rng.randint(1, authors), rng.randint(1, len(GENRES)), _sentence(rng, 10, 30))
+
+
+def _reviews(rng, n, users, books):
+    # popular books get most of the reviews, like a real catalog
+    for i in range(1, n + 1):
+        bookID = min(int(rng.paretovariate(1.2)), books)
+        bookID = (bookID * 7919 + rng.randint(0, 3)) % books + 1
+        rating = max(1, min(5, round(rng.gauss(3.6, 1.1))))
+        yield (i, rng.randint(1, users), bookID, rating, _sentence(rng, 4, 20), _date(rng, 2018, 2024))
+
+
+def _insert(c, statement, rows):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == CHUNK:
+            c.executemany(statement, chunk)
+            chunk = []
+    if chunk:
+        c.executemany(statement, chunk)
+
+
+def generate(db_file, scale, seed=348, log=print):
+    if os.path.exists(db_file):
+        raise FileExistsError(f"{db_file} already exists; generate into a fresh scratch path")
+
+    n = sizes(scale)
+    rng = random.Random(seed)
+    conn = sqlite3.connect(db_file, isolation_level=None)
+    conn.execute("PRAGMA journal_mode = OFF")
+    conn.execute("PRAGMA synchronous = OFF")
+
+    # load into the bare tables, then let the later migrations build
+    # book_stats, the search index and the join indexes in one pass each
+    migrate(conn, target=2, log=None)
+    c = conn.cursor()
+    c.execute("BEGIN")
+    c.executemany("INSERT INTO genres (genreID, genre_name) VALUES (?, ?)", enumerate(GENRES, 1))
+    _insert(c, "INSERT INTO authors (authorID, author_name) VALUES (?, ?)", _authors(rng, n["authors"]))
+    _insert(c, "INSERT INTO users (userID, username, email, join_date, bio) VALUES (?, ?, ?, ?, ?)",
+            _users(rng, n["users"]))
+    _insert(c, "INSERT INTO books (bookID, book_name, authorID, genreID, synopsis) VALUES (?, ?, ?, ?, ?)",
+            _books(rng, n["books"], n["authors"]))
+    _insert(c, "INSERT INTO reviews (reviewID, userID, bookID, rating, review, review_date) VALUES (?, ?, ?, ?, ?, ?)",
+            _reviews(rng, n["reviews"], n["users"], n["books"]))
+    c.execute("COMMIT")
+    if log:
+        log(f"loaded {n}")
+
+    migrate(conn, log=log)
+    conn.execute("ANALYZE")
+    conn.close()
+    return n
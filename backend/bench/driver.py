@@ -0,0 +1,143 @@
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from contextlib import redirect_stdout
+
+from bench.datagen import GENRES, WORDS
+
+# load driver. each worker thread draws operations from MIX (weighted, seeded
+# per thread so runs are repeatable) and records how long every request took.
+# requests go through flask's test client against the given database, or over
+# HTTP to a running server when a base url is passed.
+
+# name -> weight
+MIX = {
+    "list_books": 20,
+    "filter_books": 20,
+    "list_reviews": 10,
+    "list_genres": 8,
+    "list_authors": 8,
+    "list_users": 4,
+    "search": 10,
+    "add_review": 15,
+    "delete_review": 5,
+}
+
+
+class Catalog:
+    # names and IDs the operations pick from, read once from the database
+    def __init__(self, db_file):
+        conn = sqlite3.connect(db_file)
+        self.users = [row[0] for row in conn.execute("SELECT username FROM users ORDER BY userID LIMIT 5000")]
+        self.books = [row[0] for row in conn.execute("SELECT book_name FROM books ORDER BY bookID LIMIT 5000")]
+        self.max_review = conn.execute("SELECT COALESCE(MAX(reviewID), 0) FROM reviews").fetchone()[0]
+        conn.close()
+
+
+def _operation(name, rng, catalog):
+    # returns (method, path, query args, json body)
+    if name == "list_books":
+        return 'GET', '/api/books', {}, None
+    if name == "filter_books":
+        # the filter panel always asks for facet counts with the first page
+        args = {'genres[]': rng.sample(GENRES, rng.randint(1, 3)), 'facets': '1'}
+        if rng.random() < 0.7:
+            args['avg_rating'] = str(rng.choice([2, 3, 3.5, 4]))
+        if rng.random() < 0.5:
+            args['num_rating'] = str(rng.choice([0, 5, 20, 100]))
+        return 'GET', '/api/books', args, None
+    if name == "list_reviews":
+        return 'GET', '/api/reviews', {}, None
+    if name == "list_genres":
+        return 'GET', '/api/genres', {}, None
+    if name == "list_authors":
+        return 'GET', '/api/authors', {}, None
+    if name == "list_users":
+        return 'GET', '/api/users', {}, None
+    if name == "search":
+        return 'GET', '/api/search', {'q': rng.choice(WORDS)[:rng.randint(3, 6)]}, None
+    if name == "add_review":
+        body = {'userName': rng.choice(catalog.users), 'bookName': rng.choice(catalog.books),
+                'rating': rng.randint(1, 5), 'review': 'benchmark review', 'review_date': '01/01/2024'}
+        return 'POST', '/api/reviews', {}, body
+    if name == "delete_review":
+        return 'DELETE', f'/api/reviews/{rng.randint(1, max(catalog.max_review, 1))}', {}, None
+    raise ValueError(f"unknown operation {name}")
+
+
+class TestClientTarget:
+    def __init__(self, db_file):
+        import main
+        from db import ConnectionPool
+        main.pool = ConnectionPool(db_file)
+        self.app = main.app
+
+    def request(self, method, path, args, body):
+        client = self.app.test_client()
+        response = client.open(path, method=method, query_string=args, json=body)
+        response.get_data()
+        return response.status_code
+
+
+class HttpTarget:
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+
+    def request(self, method, path, args, body):
+        url = self.base_url + path
+        if args:
+            url += '?' + urllib.parse.urlencode(args, doseq=True)
+        data = json.dumps(body).encode() if body is not None else None
+        req = urllib.request.Request(url, data=data, method=method)
+        if data is not None:
+            req.add_header('Content-Type', 'application/json')
+        try:
+            with urllib.request.urlopen(req) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as e:
+            return e.code
+
+
+def run(target, catalog, requests=2000, threads=4, seed=348, mix=MIX):
+    # returns {"samples": {op: [seconds...]}, "errors": {op: count}, "wall": seconds}
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    samples = {name: [] for name in names}
+    errors = {name: 0 for name in names}
+    lock = threading.Lock()
+    per_thread = [requests // threads + (1 if i < requests % threads else 0) for i in range(threads)]
+
+    def worker(index):
+        rng = random.Random(seed * 1000 + index)
+        local = {name: [] for name in names}
+        local_errors = {name: 0 for name in names}
+        for _ in range(per_thread[index]):
+            name = rng.choices(names, weights)[0]
+            method, path, args, body = _operation(name, rng, catalog)
+            start = time.perf_counter()
+            status = target.request(method, path, args, body)
+            local[name].append(time.perf_counter() - start)
+            if status >= 400:
+                local_errors[name] += 1
+        with lock:
+            for name in names:
+                samples[name].extend(local[name])
+                errors[name] += local_errors[name]
+
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    # the write routes print their payloads; keep that out of the benchmark output
+    with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+        start = time.perf_counter()
+        for w in workers:
+            w.start()
+        for w in workers:
+            w.join()
+        wall = time.perf_counter() - start
+    return {"samples": samples, "errors": errors, "wall": wall}
@@ -0,0 +1,83 @@
+import json
+import platform
+import sqlite3
+import subprocess
+import time
+
+# turns raw driver samples into the JSON report and compares two reports.
+# latencies are in milliseconds, percentiles use the nearest-rank method.
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    rank = max(int(round(p / 100 * len(sorted_values) + 0.5)) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+def summarize(latencies, errors, wall):
+    values = sorted(latencies)
+    ms = lambda v: round(v * 1000, 3) if v is not None else None
+    return {
+        "count": len(values),
+        "errors": errors,
+        "throughput_rps": round(len(values) / wall, 2) if wall else None,
+        "mean_ms": ms(sum(values) / len(values)) if values else None,
+        "p50_ms": ms(percentile(values, 50)),
+        "p95_ms": ms(percentile(values, 95)),
+        "p99_ms": ms(percentile(values, 99)),
+        "max_ms": ms(values[-1]) if values else None,
+    }
+
+
+def _commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def build_report(result, meta):
+    samples, errors, wall = result["samples"], result["errors"], result["wall"]
+    everything = [v for values in samples.values() for v in values]
+    return {
+        "meta": dict(meta, commit=_commit(), timestamp=time.strftime('%Y-%m-%dT%H:%M:%S'),
+                     python=platform.python_version(), sqlite=sqlite3.sqlite_version,
+                     wall_seconds=round(wall, 3)),
+        "overall": summarize(everything, sum(errors.values()), wall),
+        "operations": {name: summarize(values, errors[name], wall) for name, values in samples.items() if values},
+    }
+
+
+def save(report, path):
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
+
+
+def load(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def _change(old, new):
+    if old is None or new is None:
+        return '-'
+    if old == 0:
+        return f"{new:.3f}"
+    return f"{(new - old) / old * 100:+.1f}%"
+
+
+def compare(old, new):
+    # prints p50/p95/p99 and throughput per operation, new vs old
+    print(f"old {old['meta'].get('commit')}  new {new['meta'].get('commit')}")
+    rows = [('overall', old['overall'], new['overall'])]
+    for name, stats in new['operations'].items():
+        if name in old['operations']:
+            rows.append((name, old['operations'][name], stats))
+
+    print(f"{'operation':<16}{'p50 ms':>20}{'p95 ms':>20}{'p99 ms':>20}{'rps':>20}")
+    for name, a, b in rows:
+        cells = []
+        for key in ('p50_ms', 'p95_ms', 'p99_ms', 'throughput_rps'):
+            cells.append(f"{b[key]} ({_change(a[key], b[key])})")
+        print(f"{name:<16}" + ''.join(f"{cell:>20}" for cell in cells))
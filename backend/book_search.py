@@ -0,0 +1,210 @@
+from aggregates import close, run_cli
+
+# denormalized copy of everything get_books returns, one row per listed book,
+# kept in step with books/authors/genres/book_stats by triggers. the faceted
+# filter on /api/books reads only this table: no joins, and each filter column
+# has an index (the genre and author ones are covering for the facet counts).
+#
+# a book is listed only while its author and genre exist, as with the inner
+# joins get_books used before. title_key is lower(book_name) so title prefixes
+# can be answered with an index range instead of a LIKE scan.
+
+BOOK_SEARCH_SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS book_search (
+            bookID INTEGER PRIMARY KEY,
+            book_name TEXT,
+            title_key TEXT,
+            author_name TEXT,
+            genre_name TEXT,
+            synopsis TEXT,
+            avg_rating REAL,
+            num_rating INTEGER NOT NULL DEFAULT 0
+       )''',
+    '''CREATE INDEX IF NOT EXISTS book_search_genre_idx
+            ON book_search(genre_name, avg_rating, num_rating, author_name)''',
+    '''CREATE INDEX IF NOT EXISTS book_search_author_idx
+            ON book_search(author_name, avg_rating, num_rating, genre_name)''',
+    '''CREATE INDEX IF NOT EXISTS book_search_avg_idx ON book_search(avg_rating)''',
+    '''CREATE INDEX IF NOT EXISTS book_search_num_idx ON book_search(num_rating)''',
+    '''CREATE INDEX IF NOT EXISTS book_search_title_idx ON book_search(title_key)''',
+    '''CREATE INDEX IF NOT EXISTS book_search_name_idx ON book_search(book_name)''',
+]
+
+_ROWS = '''SELECT B.bookID, B.book_name, lower(B.book_name), A.author_name, G.genre_name, B.synopsis,
+                  S.avg_rating, COALESCE(S.num_rating, 0)
+           FROM books B JOIN authors A ON A.authorID = B.authorID JOIN genres G ON G.genreID = B.genreID
+           LEFT JOIN book_stats S ON S.bookID = B.bookID'''
+
+_COLUMNS = 'bookID, book_name, title_key, author_name, genre_name, synopsis, avg_rating, num_rating'
+
+_REFRESH = f'''INSERT OR REPLACE INTO book_search ({_COLUMNS}) {_ROWS} WHERE {{where}};'''
+
+BOOK_SEARCH_TRIGGERS = [
+    f'''CREATE TRIGGER IF NOT EXISTS book_search_book_insert AFTER INSERT ON books
+        BEGIN
+            {_REFRESH.format(where='B.bookID = NEW.bookID')}
+        END''',
+    f'''CREATE TRIGGER IF NOT EXISTS book_search_book_update AFTER UPDATE ON books
+        BEGIN
+            DELETE FROM book_search WHERE bookID = OLD.bookID;
+            {_REFRESH.format(where='B.bookID = NEW.bookID')}
+        END''',
+    '''CREATE TRIGGER IF NOT EXISTS book_search_book_delete AFTER DELETE ON books
+        BEGIN
+            DELETE FROM book_search WHERE bookID = OLD.bookID;
+        END''',
+    f'''CREATE TRIGGER IF NOT EXISTS book_search_author_insert AFTER INSERT ON authors
+        BEGIN
+            {_REFRESH.format(where='B.authorID = NEW.authorID')}
+        END''',
+    f'''CREATE TRIGGER IF NOT EXISTS book_search_author_update AFTER UPDATE ON authors
+        BEGIN
+            DELETE FROM book_search WHERE bookID IN (SELECT bookID FROM books WHERE authorID = OLD.authorID);
+            {_REFRESH.format(where='B.authorID = NEW.authorID')}
+        END''',
+    '''CREATE TRIGGER IF NOT EXISTS book_search_author_delete AFTER DELETE ON authors
+        BEGIN
+            DELETE FROM book_search WHERE bookID IN (SELECT bookID FROM books WHERE authorID = OLD.authorID);
+        END''',
+    f'''CREATE TRIGGER IF NOT EXISTS book_search_genre_insert AFTER INSERT ON genres
+        BEGIN
+            {_REFRESH.format(where='B.genreID = NEW.genreID')}
+        END''',
+    f'''CREATE TRIGGER IF NOT EXISTS book_search_genre_update AFTER UPDATE ON genres
+        BEGIN
+            DELETE FROM book_search WHERE bookID IN (SELECT bookID FROM books WHERE genreID = OLD.genreID);
+            {_REFRESH.format(where='B.genreID = NEW.genreID')}
+        END''',
+    '''CREATE TRIGGER IF NOT EXISTS book_search_genre_delete AFTER DELETE ON genres
+        BEGIN
+            DELETE FROM book_search WHERE bookID IN (SELECT bookID FROM books WHERE genreID = OLD.genreID);
+        END''',
+    # book_stats is itself maintained by the review triggers, so ratings only
+    # need copying across
+    '''CREATE TRIGGER IF NOT EXISTS book_search_stats_insert AFTER INSERT ON book_stats
+        BEGIN
+            UPDATE book_search SET avg_rating = NEW.avg_rating, num_rating = NEW.num_rating
+            WHERE bookID = NEW.bookID;
+        END''',
+    '''CREATE TRIGGER IF NOT EXISTS book_search_stats_update AFTER UPDATE ON book_stats
+        BEGIN
+            UPDATE book_search SET avg_rating = NEW.avg_rating, num_rating = NEW.num_rating
+            WHERE bookID = NEW.bookID;
+        END''',
+    '''CREATE TRIGGER IF NOT EXISTS book_search_stats_delete AFTER DELETE ON book_stats
+        BEGIN
+            UPDATE book_search SET avg_rating = NULL, num_rating = 0 WHERE bookID = OLD.bookID;
+        END''',
+]
+
+
+def ensure_book_search(c):
+    # creates the table and triggers; backfills when the table is new
+    c.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'book_search'")
+    existed = c.fetchone() is not None
+    for statement in BOOK_SEARCH_SCHEMA + BOOK_SEARCH_TRIGGERS:
+        c.execute(statement)
+    if not existed:
+        rebuild_book_search(c)
+
+
+def rebuild_book_search(c):
+    c.execute("DELETE FROM book_search")
+    c.execute(f"INSERT INTO book_search ({_COLUMNS}) {_ROWS}")
+    return c.rowcount
+
+
+def verify_book_search(c):
+    # returns (bookID, stored, expected) for every row that has drifted
+    c.execute(_ROWS)
+    expected = {row[0]: row[1:] for row in c.fetchall()}
+    c.execute(f"SELECT {_COLUMNS} FROM book_search")
+    stored = {row[0]: row[1:] for row in c.fetchall()}
+
+    mismatches = []
+    for bookID in sorted(expected.keys() | stored.keys()):
+        want = expected.get(bookID)
+        have = stored.get(bookID)
+        if want is None or have is None or want[:5] != have[:5] or want[6] != have[6] \
+                or not close(want[5], have[5]):
+            mismatches.append((bookID, have, want))
+    return mismatches
+
+
+# FILTERS
+# each filter is (facet, sql, args). facet names the facet a filter belongs to
+# so the counts for that facet can leave it out: the genre counts show how many
+# books each genre would have under the other filters, which is what a checkbox
+# list needs to be useful once a genre is ticked.
+
+FACETS = {
+    'genres': 'genre_name',
+    'authors': 'author_name',
+}
+
+
+def parse_filters(args):
+    # request.args -> filters; bad numbers raise ValueError
+    filters = []
+
+    genres = [v for v in args.getlist('genres[]') if len(v) != 0]
+    if genres:
+        filters.append(('genres', f"genre_name IN ({', '.join('?' for _ in genres)})", tuple(genres)))
+
+    author = args.get('authorName', '')
+    if len(author) != 0:
+        filters.append(('authors', "author_name = ?", (author,)))
+
+    book = args.get('bookName', '')
+    if len(book) != 0:
+        filters.append((None, "book_name = ?", (book,)))
+
+    prefix = args.get('titlePrefix', '')
+    if len(prefix) != 0:
+        # every title starting with the prefix sorts between it and the prefix
+        # followed by the highest code point
+        filters.append((None, "title_key >= lower(?) AND title_key < lower(?) || char(1114111)", (prefix, prefix)))
+
+    avg_rating = args.get('avg_rating', '')
+    if len(avg_rating) != 0:
+        # books with no reviews have a NULL avg_rating and never match
+        filters.append((None, "avg_rating > ?", (float(avg_rating),)))
+
+    num_rating = args.get('num_rating', '')
+    if len(num_rating) != 0 and float(num_rating) >= 0:
+        filters.append((None, "num_rating > ?", (float(num_rating),)))
+
+    return filters
+
+
+def _where(filters, skip=None):
+    kept = [f for f in filters if skip is None or f[0] != skip]
+    clauses = [sql for _, sql, _ in kept]
+    args = tuple(arg for _, _, values in kept for arg in values)
+    return (' AND '.join(clauses) or '1'), args
+
+
+def books_query(filters, after):
+    # (query, args) for one page of matching books; the caller appends LIMIT's value
+    where, args = _where(filters)
+    query = f'''SELECT bookID, book_name, author_name, genre_name, synopsis, avg_rating, num_rating
+                FROM book_search WHERE bookID > ? AND {where} ORDER BY bookID LIMIT ?'''
+    return query, (after, ) + args
+
+
+def facet_counts(c, filters):
+    # {"genres": [[name, count], ...], "authors": [...]}, most books first
+    facets = {}
+    for facet, column in FACETS.items():
+        where, args = _where(filters, skip=facet)
+        c.execute(f'''SELECT {column}, COUNT(*) FROM book_search WHERE {where}
+                      GROUP BY {column} ORDER BY COUNT(*) DESC, {column}''', args)
+        facets[facet] = c.fetchall()
+    return facets
+
+
+if __name__ == '__main__':
+    run_cli("Rebuild or verify the book_search filter table.", ensure_book_search,
+            lambda c: f"rebuilt book_search for {rebuild_book_search(c)} books",
+            lambda c: [f"book {bookID}: stored {have}, expected {want}"
+                       for bookID, have, want in verify_book_search(c)])
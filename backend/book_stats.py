@@ -0,0 +1,103 @@
+from aggregates import close, run_cli
+
+# per-book rating aggregates kept in step with the reviews table by triggers,
+# so get_books can filter on avg_rating/num_rating with an index lookup instead
+# of running AVG/COUNT subqueries for every book row.
+#
+# num_rating counts every review (like COUNT(*)), num_rated only the ones with a
+# rating (like AVG(rating)), so the numbers match what the old subqueries gave.
+
+BOOK_STATS_SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS book_stats (
+            bookID INTEGER PRIMARY KEY,
+            num_rating INTEGER NOT NULL DEFAULT 0,
+            num_rated INTEGER NOT NULL DEFAULT 0,
+            rating_sum REAL NOT NULL DEFAULT 0,
+            avg_rating REAL
+       )''',
+    '''CREATE INDEX IF NOT EXISTS book_stats_avg_idx ON book_stats(avg_rating)''',
+    '''CREATE INDEX IF NOT EXISTS book_stats_num_idx ON book_stats(num_rating)''',
+    '''CREATE INDEX IF NOT EXISTS reviews_book_idx ON reviews(bookID)''',
+]
+
+_ADD = '''INSERT INTO book_stats (bookID, num_rating, num_rated, rating_sum, avg_rating)
+            SELECT {r}.bookID, 1, {r}.rating IS NOT NULL, COALESCE({r}.rating, 0), {r}.rating
+            WHERE {r}.bookID IS NOT NULL
+            ON CONFLICT(bookID) DO UPDATE SET
+                num_rating = num_rating + 1,
+                num_rated = num_rated + excluded.num_rated,
+                rating_sum = rating_sum + excluded.rating_sum,
+                avg_rating = CASE WHEN num_rated + excluded.num_rated > 0
+                             THEN (rating_sum + excluded.rating_sum) / (num_rated + excluded.num_rated) END;'''
+
+_REMOVE = '''UPDATE book_stats SET
+                num_rating = num_rating - 1,
+                num_rated = num_rated - ({r}.rating IS NOT NULL),
+                rating_sum = rating_sum - COALESCE({r}.rating, 0),
+                avg_rating = CASE WHEN num_rated - ({r}.rating IS NOT NULL) > 0
+                             THEN (rating_sum - COALESCE({r}.rating, 0)) / (num_rated - ({r}.rating IS NOT NULL)) END
+            WHERE bookID = {r}.bookID;
+            DELETE FROM book_stats WHERE bookID = {r}.bookID AND num_rating <= 0;'''
+
+BOOK_STATS_TRIGGERS = [
+    f'''CREATE TRIGGER IF NOT EXISTS book_stats_review_insert AFTER INSERT ON reviews
+        BEGIN
+            {_ADD.format(r='NEW')}
+        END''',
+    f'''CREATE TRIGGER IF NOT EXISTS book_stats_review_delete AFTER DELETE ON reviews
+        BEGIN
+            {_REMOVE.format(r='OLD')}
+        END''',
+    f'''CREATE TRIGGER IF NOT EXISTS book_stats_review_update AFTER UPDATE OF bookID, rating ON reviews
+        BEGIN
+            {_REMOVE.format(r='OLD')}
+            {_ADD.format(r='NEW')}
+        END''',
+    '''CREATE TRIGGER IF NOT EXISTS book_stats_book_delete AFTER DELETE ON books
+        BEGIN
+            DELETE FROM book_stats WHERE bookID = OLD.bookID;
+        END''',
+]
+
+_AGGREGATE = '''SELECT bookID, COUNT(*), COUNT(rating), COALESCE(SUM(rating), 0), AVG(rating)
+                FROM reviews WHERE bookID IN (SELECT bookID FROM books) GROUP BY bookID'''
+
+
+def ensure_book_stats(c):
+    # creates the table and triggers; backfills when the table is new
+    c.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'book_stats'")
+    existed = c.fetchone() is not None
+    for statement in BOOK_STATS_SCHEMA + BOOK_STATS_TRIGGERS:
+        c.execute(statement)
+    if not existed:
+        rebuild_book_stats(c)
+
+
+def rebuild_book_stats(c):
+    c.execute("DELETE FROM book_stats")
+    c.execute(f'''INSERT INTO book_stats (bookID, num_rating, num_rated, rating_sum, avg_rating)
+                  {_AGGREGATE}''')
+    return c.rowcount
+
+
+def verify_book_stats(c):
+    # returns (bookID, stored, expected) for every row that has drifted
+    c.execute(_AGGREGATE)
+    expected = {row[0]: (row[1], row[2], row[4]) for row in c.fetchall()}
+    c.execute("SELECT bookID, num_rating, num_rated, avg_rating FROM book_stats")
+    stored = {row[0]: (row[1], row[2], row[3]) for row in c.fetchall()}
+
+    mismatches = []
+    for bookID in sorted(expected.keys() | stored.keys()):
+        want = expected.get(bookID)
+        have = stored.get(bookID)
+        if want is None or have is None or want[:2] != have[:2] or not close(want[2], have[2]):
+            mismatches.append((bookID, have, want))
+    return mismatches
+
+
+if __name__ == '__main__':
+    run_cli("Rebuild or verify the book_stats rating aggregates.", ensure_book_stats,
+            lambda c: f"rebuilt book_stats for {rebuild_book_stats(c)} books",
+            lambda c: [f"book {bookID}: stored {have}, expected {want}"
+                       for bookID, have, want in verify_book_stats(c)])
@@ -0,0 +1,170 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from flask import Response, make_response, request
+from streaming import wants_ndjson
+
+# in-process cache for read-heavy GET routes. entries are keyed by route and
+# normalized query args and tagged with the tables the response was built from;
+# write routes call invalidate() with the tables they touched so only the
+# affected entries are dropped. eviction is LRU, bounded by entry count and total
+# body size, and entries also expire after ttl seconds as a safety net.
+#
+# every cached response carries an ETag and Cache-Control: no-cache, so browsers
+# revalidate with If-None-Match and get a 304 when nothing changed.
+
+class ResponseCache:
+    def __init__(self, max_bytes=32 * 1024 * 1024, max_entries=1024, ttl=300, variant=None):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.ttl = ttl
+        # variant() names the representation a request negotiated (e.g. its
+        # response format) so each one is cached under its own key
+        self.variant = variant
+
+        self._entries = OrderedDict()
+        self._size = 0
+        # bumped on every invalidate so a response built from pre-write data
+        # isn't stored after the write has already invalidated its tags
+        self._generations = {}
+        # optional callable returning a token that moves whenever another process
+        # may have written to the database (set by asgi.py when several workers
+        # share the file); their invalidate() calls never reach this cache, so
+        # the whole cache is dropped when the token changes
+        self.version = None
+        self._version_seen = None
+        self._epoch = 0
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0, "invalidations": 0, "not_modified": 0}
+
+    def _key(self):
+        args = tuple(sorted((k, tuple(sorted(request.args.getlist(k)))) for k in request.args.keys()))
+        return (request.path, args, self.variant() if self.variant else None)
+
+    def _get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry["expires"] < time.monotonic():
+                if entry is not None:
+                    self._drop(key)
+                self._stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+            return entry
+
+    def _store(self, key, tags, generations, response):
+        body = response.get_data()
+        if len(body) > self.max_bytes:
+            return
+        headers = [(k, v) for k, v in response.headers.items() if k.lower() not in ('content-length', 'set-cookie')]
+        entry = {
+            "body": body,
+            "headers": headers,
+            "etag": hashlib.blake2b(body, digest_size=16).hexdigest(),
+            "tags": tags,
+            "expires": time.monotonic() + self.ttl,
+        }
+        with self._lock:
+            if generations[None] != self._epoch or \
+                    any(self._generations.get(tag, 0) != generations[tag] for tag in tags):
+                return
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = entry
+            self._size += len(body)
+            self._stats["stores"] += 1
+            while self._entries and (self._size > self.max_bytes or len(self._entries) > self.max_entries):
+                self._drop(next(iter(self._entries)))
+                self._stats["evictions"] += 1
+        return entry
+
+    def _drop(self, key):
+        # caller holds the lock
+        entry = self._entries.pop(key)
+        self._size -= len(entry["body"])
+
+    def invalidate(self, *tags):
+        tags = set(tags)
+        with self._lock:
+            for tag in tags:
+                self._generations[tag] = self._generations.get(tag, 0) + 1
+            stale = [key for key, entry in self._entries.items() if entry["tags"] & tags]
+            for key in stale:
+                self._drop(key)
+            self._stats["invalidations"] += len(stale)
+
+    def _sync_version(self):
+        if self.version is None:
+            return
+        version = self.version()
+        with self._lock:
+            if version != self._version_seen:
+                if self._version_seen is not None:
+                    self._epoch += 1
+                    self._stats["invalidations"] += len(self._entries)
+                    self._entries.clear()
+                    self._size = 0
+                self._version_seen = version
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def cached(self, *tags, when=None):
+        # decorator for a GET view; tags are the tables its response reads from.
+        # when() can return False to bypass the cache for a particular request
+        tags = frozenset(tags)
+
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                # NDJSON exports are never cached: a hit would hand a streaming
+                # client the JSON page, and an empty export isn't a streamed
+                # response so it would otherwise be stored for JSON clients
+                if request.method != 'GET' or wants_ndjson() or (when is not None and not when()):
+                    return view(*args, **kwargs)
+
+                self._sync_version()
+                key = self._key()
+                entry = self._get(key)
+                if entry is not None:
+                    response = Response(entry["body"], status=200, headers=entry["headers"])
+                    response.headers['X-Cache'] = 'HIT'
+                else:
+                    with self._lock:
+                        generations = {tag: self._generations.get(tag, 0) for tag in tags}
+                        generations[None] = self._epoch
+                    response = make_response(view(*args, **kwargs))
+                    if response.status_code != 200 or response.is_streamed:
+                        return response
+                    entry = self._store(key, tags, generations, response)
+                    response.headers['X-Cache'] = 'MISS'
+                    if entry is None:
+                        return response
+
+                response.set_etag(entry["etag"])
+                response.headers['Cache-Control'] = 'no-cache'
+                if self.variant is not None:
+                    # the key holds the negotiated format, so shared caches must split on it too
+                    response.vary.add('Accept')
+                response = response.make_conditional(request)
+                if response.status_code == 304:
+                    with self._lock:
+                        self._stats["not_modified"] += 1
+                return response
+            return wrapper
+        return decorator
+
+    def metrics(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+            stats["bytes"] = self._size
+            stats["max_bytes"] = self.max_bytes
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_ratio"] = round(stats["hits"] / lookups, 4) if lookups else 0.0
+        return stats
@@ -0,0 +1,222 @@
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+# connection pool shared by every route in main.py. each checkout hands the
+# calling thread its own connection; nested checkouts on the same thread reuse
+# it, and idle connections go back to the pool instead of being closed.
+
+# set by instrumentation.install(). when present it is told how long each
+# checkout, statement and fetch took: checkout(seconds), statement(sql, seconds),
+# fetch(seconds)
+observer = None
+
+
+class TimedCursor(sqlite3.Cursor):
+    def execute(self, sql, parameters=()):
+        if observer is None:
+            return super().execute(sql, parameters)
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            observer.statement(sql, time.perf_counter() - start)
+
+    def executemany(self, sql, seq_of_parameters):
+        if observer is None:
+            return super().executemany(sql, seq_of_parameters)
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            observer.statement(sql, time.perf_counter() - start)
+
+    def _timed_fetch(self, fetch, *args):
+        if observer is None:
+            return fetch(*args)
+        start = time.perf_counter()
+        try:
+            return fetch(*args)
+        finally:
+            observer.fetch(time.perf_counter() - start)
+
+    def fetchone(self):
+        return self._timed_fetch(super().fetchone)
+
+    def fetchmany(self, size=None):
+        return self._timed_fetch(super().fetchmany, self.arraysize if size is None else size)
+
+    def fetchall(self):
+        return self._timed_fetch(super().fetchall)
+
+
+class TimedConnection(sqlite3.Connection):
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+
+class ConnectionPool:
+    def __init__(self, db_file, max_connections=8, timeout=30.0,
+                 journal_mode='WAL', synchronous='NORMAL', cache_size=-16000,
+                 mmap_size=256 * 1024 * 1024, busy_timeout=5000,
+                 cached_statements=256, query_only=False):
+        self.db_file = db_file
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.journal_mode = journal_mode
+        self.synchronous = synchronous
+        self.cache_size = cache_size
+        self.mmap_size = mmap_size
+        self.busy_timeout = busy_timeout
+        self.cached_statements = cached_statements
+        self.query_only = query_only
+
+        self._idle = []
+        self._open = 0
+        self._lock = threading.Condition()
+        self._local = threading.local()
+        self._generation = 0
+        self._stats = {"checkouts": 0, "waits": 0, "wait_time": 0.0, "created": 0, "closed": 0}
+
+    def _connect(self):
+        generation = self._generation
+        # isolation_level=None keeps the explicit BEGIN/COMMIT the routes already use;
+        # cached_statements is sqlite3's prepared-statement LRU per connection
+        conn = sqlite3.connect(self.db_file, timeout=self.busy_timeout / 1000,
+                               isolation_level=None, check_same_thread=False,
+                               cached_statements=self.cached_statements,
+                               factory=TimedConnection)
+        c = conn.cursor()
+        c.execute(f"PRAGMA journal_mode = {self.journal_mode}")
+        c.execute(f"PRAGMA synchronous = {self.synchronous}")
+        c.execute(f"PRAGMA cache_size = {int(self.cache_size)}")
+        c.execute(f"PRAGMA mmap_size = {int(self.mmap_size)}")
+        c.execute(f"PRAGMA busy_timeout = {int(self.busy_timeout)}")
+        if self.query_only:
+            c.execute("PRAGMA query_only = 1")
+        c.close()
+        conn.generation = generation
+        return conn
+
+    def _acquire(self):
+        with self._lock:
+            self._stats["checkouts"] += 1
+            start = time.perf_counter()
+            deadline = start + self.timeout
+            waited = False
+            # a discarded connection frees a slot without coming back idle, so a
+            # waiter looks for either one every time it wakes
+            while not self._idle and self._open >= self.max_connections:
+                if not waited:
+                    self._stats["waits"] += 1
+                    waited = True
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    raise TimeoutError("timed out waiting for a database connection")
+                self._lock.wait(remaining)
+            if waited:
+                self._stats["wait_time"] += time.perf_counter() - start
+            if self._idle:
+                return self._idle.pop()
+            self._open += 1
+            self._stats["created"] += 1
+        try:
+            return self._connect()
+        except Exception:
+            with self._lock:
+                self._open -= 1
+                self._lock.notify()
+            raise
+
+    def _release(self, conn, discard=False):
+        with self._lock:
+            discard = discard or conn.generation != self._generation
+            if discard:
+                self._open -= 1
+                self._stats["closed"] += 1
+            else:
+                self._idle.append(conn)
+            self._lock.notify()
+        if discard:
+            conn.close()
+
+    @contextmanager
+    def connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            self._local.depth += 1
+            try:
+                yield conn
+            finally:
+                self._local.depth -= 1
+            return
+
+        start = time.perf_counter()
+        conn = self._acquire()
+        if observer is not None:
+            observer.checkout(time.perf_counter() - start)
+        self._local.conn = conn
+        self._local.depth = 1
+        broken = False
+        try:
+            yield conn
+        finally:
+            self._local.conn = None
+            self._local.depth = 0
+            if conn.in_transaction:
+                try:
+                    conn.rollback()
+                except sqlite3.Error:
+                    broken = True
+            # a handle that can't roll back is not safe to hand to the next request
+            self._release(conn, discard=broken)
+
+    @contextmanager
+    def transaction(self, write=False):
+        # yields a cursor inside BEGIN/COMMIT and rolls back on any error.
+        # writes take the write lock up front with BEGIN IMMEDIATE: a deferred
+        # transaction that has to upgrade from a stale WAL snapshot fails with
+        # "database is locked" straight away instead of waiting on busy_timeout
+        with self.connection() as conn:
+            c = conn.cursor()
+            nested = conn.in_transaction
+            if not nested:
+                c.execute("BEGIN IMMEDIATE" if write else "BEGIN")
+            try:
+                yield c
+                if not nested:
+                    c.execute("COMMIT")
+            except Exception:
+                if not nested and conn.in_transaction:
+                    c.execute("ROLLBACK")
+                raise
+            finally:
+                c.close()
+
+    def metrics(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["open"] = self._open
+            stats["idle"] = len(self._idle)
+            stats["in_use"] = self._open - len(self._idle)
+            stats["max_connections"] = self.max_connections
+        stats["wait_time"] = round(stats["wait_time"], 6)
+        return stats
+
+    def recycle(self):
+        # for when the file at db_file has been replaced: idle connections are
+        # closed now and checked-out ones when they come back, so every later
+        # checkout opens the new file
+        with self._lock:
+            self._generation += 1
+        self.close_all()
+
+    def close_all(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+            self._open -= len(idle)
+            self._stats["closed"] += len(idle)
+            self._lock.notify_all()
+        for conn in idle:
+            conn.close()
@@ -0,0 +1,110 @@
+import gzip
+from flask import Response, current_app, request
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# response encodings for the list routes, picked by ?format= or the Accept header:
+#
+#   json      the default: a JSON array of row arrays
+#   columnar  one array per column instead of per row. a text column with
+#             repeated values (author and genre names) is interned as
+#             {"values": [distinct...], "index": [position of each row's value]}
+#   msgpack   the same rows as MessagePack; needs the msgpack package
+#
+# separately, any response of COMPRESS_MIN_BYTES or more is gzip (or brotli, with
+# the brotli package) compressed when the client accepts it.
+
+JSON = 'application/json'
+COLUMNAR = 'application/vnd.plantyourbooks.columnar+json'
+MSGPACK = 'application/x-msgpack'
+
+FORMATS = {'json': JSON, 'columnar': COLUMNAR, 'msgpack': MSGPACK}
+
+COMPRESS_MIN_BYTES = 1024
+GZIP_LEVEL = 5
+BROTLI_QUALITY = 4
+
+
+def response_format():
+    # ?format=json|columnar|msgpack wins over Accept; clients that accept
+    # anything get json
+    name = request.args.get('format')
+    if name in FORMATS:
+        return name
+    offered = [JSON, COLUMNAR] + ([MSGPACK] if msgpack is not None else [])
+    best = request.accept_mimetypes.best_match(offered, default=JSON)
+    return next(name for name, mimetype in FORMATS.items() if mimetype == best)
+
+
+def columns(rows):
+    # rows -> {"rows": n, "columns": [...]}; interning only kicks in when a
+    # column has at most half as many distinct values as rows
+    out = []
+    for column in zip(*rows):
+        if any(isinstance(value, str) for value in column):
+            distinct = {}
+            index = [distinct.setdefault(value, len(distinct)) for value in column]
+            if len(distinct) * 2 <= len(column):
+                out.append({"values": list(distinct), "index": index})
+                continue
+        out.append(list(column))
+    return {"rows": len(rows), "columns": out}
+
+
+def encoded_response(rows, wrap=None):
+    # wrap(page) can put the encoded rows inside a larger body
+    fmt = response_format()
+    page = columns(rows) if fmt == 'columnar' else rows
+    body = page if wrap is None else wrap(page)
+
+    if fmt == 'msgpack':
+        if msgpack is None:
+            raise ValueError("MessagePack responses need the msgpack package")
+        response = Response(msgpack.packb(body, use_bin_type=True), mimetype=MSGPACK)
+    else:
+        response = current_app.json.response(body)
+        response.mimetype = FORMATS[fmt]
+    response.vary.add('Accept')
+    return response
+
+
+def _pick_encoding():
+    accepted = request.accept_encodings
+    if brotli is not None and accepted['br']:
+        return 'br'
+    if accepted['gzip']:
+        return 'gzip'
+    return None
+
+
+def compress_response(response):
+    # after_request hook, installed in main.py
+    if response.is_streamed or response.direct_passthrough or 'Content-Encoding' in response.headers \
+            or response.status_code < 200 or response.status_code in (204, 304):
+        return response
+    response.vary.add('Accept-Encoding')
+    data = response.get_data()
+    if len(data) < COMPRESS_MIN_BYTES:
+        return response
+    encoding = _pick_encoding()
+    if encoding is None:
+        return response
+
+    if encoding == 'br':
+        response.set_data(brotli.compress(data, quality=BROTLI_QUALITY))
+    else:
+        response.set_data(gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0))
+    response.headers['Content-Encoding'] = encoding
+    # the compressed bytes differ from the ones the strong ETag was computed on
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
@@ -0,0 +1,186 @@
+import argparse
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+
+import main
+from cache import ResponseCache
+from db import ConnectionPool
+from ingest import ReviewQueue
+from migrations import migrate, JOIN_INDEXES
+
+# index advisor. replays a representative set of requests against a scratch
+# copy of the database, records every statement the routes send to sqlite,
+# and runs EXPLAIN QUERY PLAN on each one. plans that scan a whole table are
+# flagged. each statement is timed twice: once without the JOIN_INDEXES from
+# migration 5 ("before") and once with them ("after").
+#
+#   python backend/index_advisor.py [--db backend/database.db] [--repeat 20] [--json report.json]
+
+STATEMENTS = ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH')
+
+
+def _sample(conn, query):
+    row = conn.execute(query).fetchone()
+    return row[0] if row else ''
+
+
+def _requests(conn):
+    # (method, path, query string or json body) covering every route that reads
+    # or writes the main tables, filled in with names that exist in the database
+    genre = _sample(conn, "SELECT genre_name FROM genres ORDER BY genreID LIMIT 1")
+    author = _sample(conn, "SELECT author_name FROM authors ORDER BY authorID LIMIT 1")
+    book = _sample(conn, "SELECT book_name FROM books ORDER BY bookID LIMIT 1")
+    user = _sample(conn, "SELECT username FROM users ORDER BY userID LIMIT 1")
+    bookID = _sample(conn, "SELECT bookID FROM books ORDER BY bookID LIMIT 1")
+    userID = _sample(conn, "SELECT userID FROM users ORDER BY userID LIMIT 1")
+    word = (book.split() or ['a'])[0]
+    review = {'userName': user, 'bookName': book, 'rating': 4, 'review': 'advisor', 'review_date': '01/01/2024'}
+    return [
+        ('GET', '/api/users', {}),
+        ('GET', '/api/books', {}),
+        ('GET', '/api/books', {'genres[]': [genre, genre + 'x'], 'avg_rating': '1', 'num_rating': '0'}),
+        ('GET', '/api/books', {'authorName': author, 'bookName': book}),
+        ('GET', '/api/books', {'facets': '1', 'genres[]': [genre], 'titlePrefix': book[:3], 'avg_rating': '1'}),
+        ('GET', '/api/reviews', {}),
+        ('GET', '/api/genres', {}),
+        ('GET', '/api/authors', {}),
+        ('GET', '/api/search', {'q': word}),
+        ('GET', f'/api/books/{bookID}/similar', {}),
+        ('GET', f'/api/users/{userID}/recommendations', {}),
+        ('GET', '/api/leaderboards/books', {}),
+        ('GET', '/api/leaderboards/books', {'genre': genre}),
+        ('GET', '/api/leaderboards/reviewers', {}),
+        ('GET', '/api/stats/ratings', {'period': 'month'}),
+        ('GET', '/api/stats/ratings', {'period': 'month', 'from': '2000-01', 'to': '2100-12'}),
+        ('POST', '/api/reviews', review),
+        ('POST', '/api/reviews/batch', [review]),
+        ('POST', '/api/books', {'bookName': 'advisor', 'authorName': author, 'genreName': genre, 'synopsis': ''}),
+        ('DELETE', '/api/reviews/0', None),
+        ('DELETE', '/api/users/0', None),
+        ('DELETE', '/api/books/0', None),
+        ('DELETE', '/api/genres/0', None),
+        ('DELETE', '/api/authors/0', None),
+    ]
+
+
+def capture_statements(db_file):
+    # runs the request mix through the flask app and returns the distinct SQL it issued
+    statements = []
+    pool = ConnectionPool(db_file, max_connections=1)
+    main.pool = pool
+    main.cache = ResponseCache()
+    # the review writer would wait forever for the one connection this thread
+    # holds, so queued reviews are committed here, on the traced connection
+    main.review_queue = ReviewQueue(lambda: pool, writer_thread=False, log=None)
+
+    with pool.connection() as conn:
+        requests = _requests(conn)
+        conn.set_trace_callback(statements.append)
+        client = main.app.test_client()
+        for method, path, payload in requests:
+            main.cache.clear()
+            if method == 'GET':
+                client.get(path, query_string=payload)
+            elif method == 'POST':
+                client.post(path, json=payload, headers={'Prefer': 'respond-async'})
+            else:
+                client.delete(path)
+            main.review_queue.flush()
+        conn.set_trace_callback(None)
+    pool.close_all()
+
+    seen = []
+    for statement in statements:
+        statement = statement.strip()
+        # FTS5 reads its own shadow tables as 'main'.'x_config' etc; those aren't ours to index
+        if "'main'." in statement:
+            continue
+        if statement.upper().startswith(STATEMENTS) and statement not in seen:
+            seen.append(statement)
+    return seen
+
+
+def full_scans(plan):
+    # "SCAN books" reads the whole table; "SCAN books USING INDEX" or
+    # "USING COVERING INDEX" at least walks an index in order
+    return [detail for detail in plan if detail.startswith('SCAN') and 'INDEX' not in detail
+            and 'VIRTUAL TABLE' not in detail]
+
+
+def analyze(conn, statement, repeat):
+    plan = [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + statement).fetchall()]
+    # writes are rolled back so every run sees the same data
+    start = time.perf_counter()
+    for _ in range(repeat):
+        conn.execute("BEGIN")
+        conn.execute(statement).fetchall()
+        conn.execute("ROLLBACK")
+    elapsed = (time.perf_counter() - start) / repeat
+    return {"plan": plan, "full_scans": full_scans(plan), "ms": round(elapsed * 1000, 4)}
+
+
+def advise(db_file, repeat=20):
+    scratch_dir = tempfile.mkdtemp()
+    scratch = os.path.join(scratch_dir, 'advisor.db')
+    try:
+        source = sqlite3.connect(db_file)
+        target = sqlite3.connect(scratch, isolation_level=None)
+        source.backup(target)
+        source.close()
+        migrate(target, log=None)
+        target.close()
+
+        # the requests write, so they run on a copy of their own; replaying a
+        # captured INSERT over the row it already stored would fail
+        captured = os.path.join(scratch_dir, 'capture.db')
+        shutil.copyfile(scratch, captured)
+        statements = capture_statements(captured)
+
+        conn = sqlite3.connect(scratch, isolation_level=None)
+        for name in JOIN_INDEXES:
+            conn.execute(f"DROP INDEX IF EXISTS {name}")
+        before = [analyze(conn, statement, repeat) for statement in statements]
+        for name, on in JOIN_INDEXES.items():
+            conn.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {on}")
+        after = [analyze(conn, statement, repeat) for statement in statements]
+        conn.close()
+    finally:
+        shutil.rmtree(scratch_dir, ignore_errors=True)
+
+    return [{"statement": s, "before": b, "after": a} for s, b, a in zip(statements, before, after)]
+
+
+def print_report(report):
+    flagged = 0
+    for entry in report:
+        after = entry["after"]
+        print(entry["statement"])
+        print(f"  before {entry['before']['ms']:.4f} ms  after {after['ms']:.4f} ms")
+        for detail in entry["before"]["full_scans"]:
+            if detail not in after["full_scans"]:
+                print(f"  fixed: {detail}")
+        for detail in after["plan"]:
+            marker = '!' if detail in after["full_scans"] else ' '
+            print(f"  {marker} {detail}")
+        if after["full_scans"]:
+            flagged += 1
+        print()
+    print(f"{len(report)} statements, {flagged} still doing full table scans")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Explain and time every query the API routes issue.")
+    parser.add_argument('--db', default='backend/database.db')
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--json', help="also write the report to this file")
+    args = parser.parse_args()
+
+    report = advise(args.db, args.repeat)
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
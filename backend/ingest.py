@@ -0,0 +1,315 @@
+import queue
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+# review submissions go through an in-process queue drained by one writer
+# thread, which commits them in groups: whatever arrived within max_delay
+# seconds of the first row, up to max_batch rows, in a single transaction. a
+# burst of reviews then costs a few write locks instead of one per request, and
+# requests queue here instead of failing on "database is locked".
+#
+# a client can send an Idempotency-Key; a second submission with the same key
+# gets the first one's submission back instead of adding another review. keys
+# are checked in memory while the first is still queued and against
+# review_submissions once it is stored, inside the writing transaction so two
+# processes can't both store the same key. submissions and their outcome are
+# kept for RETENTION seconds so clients can look them up by ID.
+#
+# every row gets its own savepoint, so one bad row fails alone rather than
+# taking its batch with it.
+
+RETENTION = 24 * 60 * 60
+PRUNE_EVERY = 60.0
+RECENT = 10000
+
+INGEST_SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS review_submissions (
+            submissionID TEXT PRIMARY KEY,
+            idempotency_key TEXT,
+            status TEXT NOT NULL,
+            reviewID INTEGER,
+            error TEXT,
+            submitted_at REAL NOT NULL
+       )''',
+    '''CREATE INDEX IF NOT EXISTS review_submissions_key_idx
+            ON review_submissions(idempotency_key) WHERE idempotency_key IS NOT NULL''',
+    '''CREATE INDEX IF NOT EXISTS review_submissions_time_idx ON review_submissions(submitted_at)''',
+]
+
+INSERT_REVIEW = '''INSERT INTO reviews (userID, bookID, rating, review, review_date)
+                   VALUES ((SELECT min(userID) FROM users WHERE username = ?),
+                           (SELECT min(bookID) FROM books WHERE book_name = ?), ?, ?, ?)'''
+
+_STOP = object()
+
+
+class QueueFull(Exception):
+    pass
+
+
+class QueueClosed(Exception):
+    pass
+
+
+def ensure_ingest(c):
+    for statement in INGEST_SCHEMA:
+        c.execute(statement)
+
+
+class Submission:
+    # status is 'queued' until its batch commits, then 'stored', 'duplicate'
+    # (reviewID is the original's) or 'failed'
+    def __init__(self, values, key=None, id=None, status='queued', reviewID=None, error=None, submitted_at=None):
+        self.id = id or uuid.uuid4().hex
+        self.key = key
+        self.values = values
+        self.status = status
+        self.reviewID = reviewID
+        self.error = error
+        self.submitted_at = time.time() if submitted_at is None else submitted_at
+        self.done = threading.Event()
+        if status != 'queued':
+            self.done.set()
+
+    def wait(self, timeout=None):
+        return self.done.wait(timeout)
+
+    def as_dict(self):
+        return {"id": self.id, "status": self.status, "reviewID": self.reviewID, "error": self.error}
+
+
+def review_values(data):
+    # request body -> INSERT_REVIEW arguments, as post_added_reviews always took them
+    if not isinstance(data, dict):
+        raise ValueError("expected a JSON object")
+    return (data.get('userName'), data.get('bookName'), data.get('rating'), data.get('review'),
+            data.get('review_date'))
+
+
+class ReviewQueue:
+    def __init__(self, get_pool, max_batch=100, max_delay=0.01, max_pending=10000,
+                 on_commit=None, observer=None, log=print, writer_thread=True):
+        self.get_pool = get_pool
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.max_pending = max_pending
+        # on_commit() runs after every batch that stored something, before any
+        # of its submitters are woken; observer(rows, seconds) after every batch
+        self.on_commit = on_commit
+        self.observer = observer
+        self.log = log
+        # without the writer thread, submissions wait for flush() on the caller's
+        # thread (index_advisor traces every statement on a single connection)
+        self.writer_thread = writer_thread
+
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._keys = {}
+        self._recent = OrderedDict()
+        self._closed = False
+        self._thread = None
+        self._last_prune = 0.0
+        self._stats = {"submitted": 0, "duplicates": 0, "rejected": 0, "batches": 0, "stored": 0,
+                       "failed": 0, "last_batch_size": 0, "last_commit_seconds": 0.0}
+
+    # SUBMITTING
+
+    def submit(self, data, key=None):
+        # returns (submission, created); created is False when key matched an
+        # earlier submission, which is returned instead
+        values = review_values(data)
+        if key is not None:
+            earlier = self._by_key(key)
+            if earlier is not None:
+                return earlier, False
+
+        submission = Submission(values, key)
+        with self._lock:
+            if self._closed:
+                raise QueueClosed("review queue is shutting down")
+            if key is not None and key in self._keys:
+                self._stats["duplicates"] += 1
+                return self._keys[key], False
+            if self._queue.qsize() >= self.max_pending:
+                self._stats["rejected"] += 1
+                raise QueueFull(f"more than {self.max_pending} reviews waiting to be written")
+            self._pending[submission.id] = submission
+            if key is not None:
+                self._keys[key] = submission
+            self._queue.put(submission)
+            self._stats["submitted"] += 1
+            if self._thread is None and self.writer_thread:
+                self._start()
+        return submission, True
+
+    def _by_key(self, key):
+        with self._lock:
+            if key in self._keys:
+                self._stats["duplicates"] += 1
+                return self._keys[key]
+        # a stored submission leaves _keys only after its row is committed, so
+        # missing it in memory means the database has it if anyone does
+        with self.get_pool().transaction() as c:
+            c.execute('''SELECT submissionID, status, reviewID, submitted_at FROM review_submissions
+                         WHERE idempotency_key = ? AND status = 'stored' ''', (key,))
+            row = c.fetchone()
+        if row is None:
+            return None
+        with self._lock:
+            self._stats["duplicates"] += 1
+        return Submission(None, key, id=row[0], status=row[1], reviewID=row[2], submitted_at=row[3])
+
+    def lookup(self, submission_id):
+        # the submission with this ID, or None. a submission queued in another
+        # process is only found once it is stored
+        with self._lock:
+            submission = self._pending.get(submission_id) or self._recent.get(submission_id)
+        if submission is not None:
+            return submission
+        with self.get_pool().transaction() as c:
+            c.execute('''SELECT idempotency_key, status, reviewID, error, submitted_at
+                         FROM review_submissions WHERE submissionID = ?''', (submission_id,))
+            row = c.fetchone()
+        if row is None:
+            return None
+        return Submission(None, row[0], id=submission_id, status=row[1], reviewID=row[2], error=row[3],
+                          submitted_at=row[4])
+
+    # WRITING
+
+    def _take(self):
+        # blocks for the first submission, then gathers more until max_delay has
+        # passed or max_batch are in hand. returns (batch, stopping)
+        first = self._queue.get()
+        if first is _STOP:
+            return [], True
+        batch = [first]
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _STOP:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _apply(self, c, submission):
+        if submission.key is not None:
+            c.execute('''SELECT reviewID FROM review_submissions
+                         WHERE idempotency_key = ? AND status = 'stored' ''', (submission.key,))
+            row = c.fetchone()
+            if row is not None:
+                submission.status, submission.reviewID = 'duplicate', row[0]
+        if submission.status != 'duplicate':
+            c.execute("SAVEPOINT submission")
+            try:
+                c.execute(INSERT_REVIEW, submission.values)
+                submission.status, submission.reviewID = 'stored', c.lastrowid
+            except sqlite3.Error as e:
+                c.execute("ROLLBACK TO submission")
+                submission.status, submission.error = 'failed', str(e)
+            c.execute("RELEASE submission")
+        c.execute('''INSERT INTO review_submissions (submissionID, idempotency_key, status, reviewID, error, submitted_at)
+                     VALUES (?, ?, ?, ?, ?, ?)''',
+                  (submission.id, submission.key, submission.status, submission.reviewID, submission.error,
+                   submission.submitted_at))
+
+    def _prune(self, c):
+        now = time.time()
+        if now - self._last_prune >= PRUNE_EVERY:
+            c.execute("DELETE FROM review_submissions WHERE submitted_at < ?", (now - RETENTION, ))
+            self._last_prune = now
+
+    def _commit(self, batch):
+        start = time.perf_counter()
+        try:
+            with self.get_pool().transaction(write=True) as c:
+                for submission in batch:
+                    self._apply(c, submission)
+                self._prune(c)
+        except Exception as e:
+            for submission in batch:
+                submission.status, submission.reviewID, submission.error = 'failed', None, str(e)
+            if self.log:
+                self.log(f"review batch of {len(batch)} failed: {e}")
+        seconds = time.perf_counter() - start
+
+        stored = sum(1 for submission in batch if submission.status == 'stored')
+        if stored and self.on_commit is not None:
+            self.on_commit()
+        if self.observer is not None:
+            self.observer(len(batch), seconds)
+        with self._lock:
+            self._stats["batches"] += 1
+            self._stats["stored"] += stored
+            self._stats["failed"] += sum(1 for submission in batch if submission.status == 'failed')
+            self._stats["last_batch_size"] = len(batch)
+            self._stats["last_commit_seconds"] = seconds
+            for submission in batch:
+                self._pending.pop(submission.id, None)
+                if submission.key is not None and self._keys.get(submission.key) is submission:
+                    del self._keys[submission.key]
+                self._recent[submission.id] = submission
+            while len(self._recent) > RECENT:
+                self._recent.popitem(last=False)
+        for submission in batch:
+            submission.done.set()
+
+    def _run(self):
+        while True:
+            batch, stopping = self._take()
+            if batch:
+                self._commit(batch)
+            if stopping:
+                return
+
+    def flush(self):
+        # commits everything queued so far on the calling thread
+        batch = []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not _STOP:
+                batch.append(item)
+        for start in range(0, len(batch), self.max_batch):
+            self._commit(batch[start:start + self.max_batch])
+        return len(batch)
+
+    def _start(self):
+        # callers hold _lock
+        self._thread = threading.Thread(target=self._run, name='review-writer', daemon=True)
+        self._thread.start()
+
+    def start(self):
+        with self._lock:
+            if self._thread is None and self.writer_thread and not self._closed:
+                self._start()
+
+    def stop(self, timeout=None):
+        # stops taking submissions and waits for the writer to commit everything
+        # already queued
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(_STOP)
+            thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+
+    def metrics(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats["queue_depth"] = self._queue.qsize()
+        stats["max_pending"] = self.max_pending
+        stats["last_commit_seconds"] = round(stats["last_commit_seconds"], 6)
+        return stats
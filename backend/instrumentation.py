@@ -0,0 +1,256 @@
+import cProfile
+import logging
+import os
+import random
+import re
+import threading
+import time
+from collections import defaultdict
+from functools import lru_cache
+from flask import Response, g, has_request_context, request
+from flask.json.provider import DefaultJSONProvider
+
+import db
+
+# request and SQL instrumentation for the flask app.
+#
+# every request gets timing spans for the time spent checking out a connection,
+# executing SQL, fetching rows and serializing JSON; they are recorded in
+# per-route histograms and sent back in a Server-Timing header. every statement
+# is also timed under its normalized text, and statements slower than
+# SLOW_QUERY_MS are logged to the "plantyourbooks.slow_query" logger.
+# /metrics serves all of it in the prometheus text format.
+#
+# cProfile can be switched on for a sample of requests with PROFILE_SAMPLE_RATE
+# (0 to 1), or per request with an "X-Profile: 1" header when PROFILE_HEADER=1.
+# profiles are written to PROFILE_DIR as pstats files. only one request is
+# profiled at a time: a profiler sees every thread's calls (and on 3.12 a
+# second one can't be enabled at all), so overlapping requests go unprofiled.
+
+PREFIX = 'plantyourbooks_'
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+PHASES = ('checkout', 'sql', 'fetch', 'serialize', 'app')
+
+METRICS = {
+    'request_duration_seconds': ('histogram', "Request latency by route."),
+    'request_phase_seconds': ('histogram', "Time per request spent in each phase, by route."),
+    'sql_duration_seconds': ('histogram', "Statement execution time by normalized query."),
+    'requests_total': ('counter', "Requests by route and status."),
+    'slow_queries_total': ('counter', "Statements slower than the slow query threshold."),
+    'ingest_batch_rows': ('histogram', "Reviews written per group commit."),
+    'ingest_commit_seconds': ('histogram', "Time to write and commit one batch of reviews."),
+}
+
+# histograms that don't measure seconds
+HISTOGRAM_BUCKETS = {
+    'ingest_batch_rows': (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000),
+}
+
+slow_query_log = logging.getLogger('plantyourbooks.slow_query')
+
+_profiling = threading.Lock()
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"(?<![\w.])-?\d+(?:\.\d+)?\b")
+_IN_LIST = re.compile(r"\bIN\s*\(\s*\?(?:\s*,\s*\?)*\s*\)", re.IGNORECASE)
+_OR_CHAIN = re.compile(r"([\w.]+ = \?)(?: OR \1)+")
+_SPACE = re.compile(r"\s+")
+
+
+@lru_cache(maxsize=1024)
+def normalize_sql(sql):
+    # one label per query shape: literals become ?, IN lists and repeated
+    # "col = ? OR col = ?" filters collapse, whitespace is squeezed
+    sql = _STRING.sub('?', sql)
+    sql = _NUMBER.sub('?', sql)
+    sql = _SPACE.sub(' ', sql).strip()
+    sql = _IN_LIST.sub('IN (...)', sql)
+    sql = _OR_CHAIN.sub(r'\1 OR ...', sql)
+    return sql
+
+
+def _add_span(phase, seconds):
+    if has_request_context() and 'spans' in g:
+        g.spans[phase] += seconds
+
+
+class TimedJSONProvider(DefaultJSONProvider):
+    def response(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return super().response(*args, **kwargs)
+        finally:
+            _add_span('serialize', time.perf_counter() - start)
+
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+
+def _labels(labels):
+    def escape(value):
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return ','.join(f'{k}="{escape(v)}"' for k, v in labels)
+
+
+class Metrics:
+    def __init__(self, slow_query_ms=100.0, profile_rate=0.0, profile_header=False,
+                 profile_dir='/tmp/plantyourbooks-profiles'):
+        self.slow_query_ms = slow_query_ms
+        self.profile_rate = profile_rate
+        self.profile_header = profile_header
+        self.profile_dir = profile_dir
+
+        self._lock = threading.Lock()
+        self._histograms = defaultdict(dict)
+        self._counters = defaultdict(lambda: defaultdict(int))
+        self._gauges = []
+
+    @classmethod
+    def from_env(cls):
+        return cls(slow_query_ms=float(os.environ.get('SLOW_QUERY_MS', 100)),
+                   profile_rate=float(os.environ.get('PROFILE_SAMPLE_RATE', 0)),
+                   profile_header=os.environ.get('PROFILE_HEADER') == '1',
+                   profile_dir=os.environ.get('PROFILE_DIR', '/tmp/plantyourbooks-profiles'))
+
+    def observe(self, name, labels, value):
+        with self._lock:
+            histogram = self._histograms[name].get(labels)
+            if histogram is None:
+                histogram = self._histograms[name][labels] = Histogram(HISTOGRAM_BUCKETS.get(name, BUCKETS))
+            histogram.observe(value)
+
+    def inc(self, name, labels, amount=1):
+        with self._lock:
+            self._counters[name][labels] += amount
+
+    def register_gauges(self, prefix, collect, help=''):
+        # collect() returns a dict; each numeric value is exported as PREFIX + prefix_key
+        self._gauges.append((prefix, collect, help))
+
+    # db.observer protocol
+
+    def checkout(self, seconds):
+        _add_span('checkout', seconds)
+
+    def statement(self, sql, seconds):
+        query = normalize_sql(sql)
+        self.observe('sql_duration_seconds', (('query', query),), seconds)
+        _add_span('sql', seconds)
+        if seconds * 1000 >= self.slow_query_ms:
+            self.inc('slow_queries_total', (('query', query),))
+            route = request.path if has_request_context() else '-'
+            slow_query_log.warning("slow query %.1f ms on %s: %s", seconds * 1000, route, query)
+
+    def fetch(self, seconds):
+        _add_span('fetch', seconds)
+
+    # flask hooks
+
+    def _should_profile(self):
+        if self.profile_header and request.headers.get('X-Profile') == '1':
+            return True
+        return self.profile_rate > 0 and random.random() < self.profile_rate
+
+    def _before_request(self):
+        g.request_start = time.perf_counter()
+        g.spans = defaultdict(float)
+        if self._should_profile() and _profiling.acquire(blocking=False):
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+            except ValueError:
+                # another profiling tool (a debugger, a coverage run) is active
+                _profiling.release()
+                return
+            g.profiler = profiler
+
+    def _stop_profiler(self):
+        profiler = g.pop('profiler', None)
+        if profiler is not None:
+            profiler.disable()
+            _profiling.release()
+        return profiler
+
+    def _teardown_request(self, exc):
+        # after_request doesn't run when the view raises
+        self._stop_profiler()
+
+    def _after_request(self, response):
+        if 'request_start' not in g:
+            return response
+        total = time.perf_counter() - g.request_start
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        method = request.method
+
+        spans = g.spans
+        spans['app'] = max(total - sum(spans[phase] for phase in PHASES if phase != 'app'), 0.0)
+        self.observe('request_duration_seconds', (('route', route), ('method', method)), total)
+        for phase in PHASES:
+            self.observe('request_phase_seconds', (('route', route), ('method', method), ('phase', phase)), spans[phase])
+        self.inc('requests_total', (('route', route), ('method', method), ('status', str(response.status_code))))
+
+        timings = [f"{phase};dur={spans[phase] * 1000:.3f}" for phase in PHASES]
+        timings.append(f"total;dur={total * 1000:.3f}")
+        response.headers['Server-Timing'] = ', '.join(timings)
+
+        profiler = self._stop_profiler()
+        if profiler is not None:
+            os.makedirs(self.profile_dir, exist_ok=True)
+            name = re.sub(r'[^\w]+', '_', route).strip('_') or 'root'
+            path = os.path.join(self.profile_dir, f"{name}_{time.time_ns()}.prof")
+            profiler.dump_stats(path)
+            response.headers['X-Profile-File'] = path
+        return response
+
+    def render(self):
+        lines = []
+        with self._lock:
+            for name, (kind, help) in METRICS.items():
+                full = PREFIX + name
+                lines.append(f"# HELP {full} {help}")
+                lines.append(f"# TYPE {full} {kind}")
+                if kind == 'histogram':
+                    for labels, histogram in self._histograms.get(name, {}).items():
+                        cumulative = 0
+                        for bound, count in zip(histogram.buckets, histogram.counts):
+                            cumulative += count
+                            lines.append(f'{full}_bucket{{{_labels(labels + (("le", bound),))}}} {cumulative}')
+                        lines.append(f'{full}_bucket{{{_labels(labels + (("le", "+Inf"),))}}} {histogram.count}')
+                        lines.append(f'{full}_sum{{{_labels(labels)}}} {histogram.sum}')
+                        lines.append(f'{full}_count{{{_labels(labels)}}} {histogram.count}')
+                else:
+                    for labels, value in self._counters.get(name, {}).items():
+                        lines.append(f'{full}{{{_labels(labels)}}} {value}')
+
+        for prefix, collect, help in self._gauges:
+            for key, value in collect().items():
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                full = f"{PREFIX}{prefix}_{key}"
+                if help:
+                    lines.append(f"# HELP {full} {help}")
+                lines.append(f"# TYPE {full} gauge")
+                lines.append(f"{full} {value}")
+        return '\n'.join(lines) + '\n'
+
+    def install(self, app):
+        db.observer = self
+        app.json = TimedJSONProvider(app)
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+        app.add_url_rule('/metrics', 'metrics',
+                         lambda: Response(self.render(), mimetype='text/plain; version=0.0.4'))
@@ -0,0 +1,281 @@
+from aggregates import close, run_cli
+
+# small precomputed tables behind the leaderboard and statistics routes, kept
+# in step with reviews by triggers so none of the routes scan reviews:
+#
+#   book_scores       one row per rated book with its Bayesian-average rating,
+#                     indexed by genre so a genre's top books are an index range
+#   reviewer_stats    review counts per user, indexed by count
+#   rating_histogram  how many reviews gave each rating, per day and per month
+#                     of review_date
+#
+# the Bayesian average pulls books with few ratings towards the prior mean:
+#
+#   (weight * mean + rating_sum) / (weight + num_rated)
+#
+# mean and weight live in leaderboard_prior so the triggers can read them. mean
+# is the average rating over all reviews as of the last backfill; it is not
+# moved on every review, which would reorder every book at once.
+#
+# review_date is free text: 'MM/DD/YYYY' (what the seed data and the form use)
+# and ISO 'YYYY-MM-DD...' dates are bucketed, anything else is left out of the
+# histogram.
+
+PRIOR_WEIGHT = 10.0
+DEFAULT_MEAN = 3.0
+
+LEADERBOARD_SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS leaderboard_prior (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            mean REAL NOT NULL,
+            weight REAL NOT NULL
+       )''',
+    '''CREATE TABLE IF NOT EXISTS book_scores (
+            bookID INTEGER PRIMARY KEY,
+            genreID INTEGER,
+            num_rated INTEGER NOT NULL,
+            bayes_rating REAL NOT NULL
+       )''',
+    '''CREATE INDEX IF NOT EXISTS book_scores_genre_idx ON book_scores(genreID, bayes_rating DESC, bookID)''',
+    '''CREATE TABLE IF NOT EXISTS reviewer_stats (
+            userID INTEGER PRIMARY KEY,
+            num_reviews INTEGER NOT NULL,
+            num_rated INTEGER NOT NULL,
+            rating_sum REAL NOT NULL
+       )''',
+    '''CREATE INDEX IF NOT EXISTS reviewer_stats_count_idx ON reviewer_stats(num_reviews DESC, userID)''',
+    '''CREATE TABLE IF NOT EXISTS rating_histogram (
+            period TEXT NOT NULL,
+            bucket TEXT NOT NULL,
+            rating REAL NOT NULL,
+            num_reviews INTEGER NOT NULL,
+            PRIMARY KEY (period, bucket, rating)
+       ) WITHOUT ROWID''',
+]
+
+PERIODS = ('day', 'month')
+
+
+def _day(date):
+    # SQL turning a review_date expression into 'YYYY-MM-DD', or NULL
+    return f'''CASE WHEN {date} GLOB '[0-9][0-9]/[0-9][0-9]/[0-9][0-9][0-9][0-9]'
+                    THEN substr({date}, 7, 4) || '-' || substr({date}, 1, 2) || '-' || substr({date}, 4, 2)
+                    WHEN {date} GLOB '[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9]*'
+                    THEN substr({date}, 1, 10) END'''
+
+
+def _bucket(period, date):
+    return _day(date) if period == 'day' else f"substr({_day(date)}, 1, 7)"
+
+
+_SCORE = '''INSERT INTO book_scores (bookID, genreID, num_rated, bayes_rating)
+            SELECT {s}.bookID, B.genreID, {s}.num_rated, (P.weight * P.mean + {s}.rating_sum) / (P.weight + {s}.num_rated)
+            FROM books B, leaderboard_prior P WHERE B.bookID = {s}.bookID AND {s}.num_rated > 0
+            ON CONFLICT(bookID) DO UPDATE SET
+                genreID = excluded.genreID,
+                num_rated = excluded.num_rated,
+                bayes_rating = excluded.bayes_rating;
+            DELETE FROM book_scores WHERE bookID = {s}.bookID AND {s}.num_rated = 0;'''
+
+_REVIEWER_ADD = '''INSERT INTO reviewer_stats (userID, num_reviews, num_rated, rating_sum)
+            SELECT {r}.userID, 1, {r}.rating IS NOT NULL, COALESCE({r}.rating, 0)
+            WHERE {r}.userID IN (SELECT userID FROM users)
+            ON CONFLICT(userID) DO UPDATE SET
+                num_reviews = num_reviews + 1,
+                num_rated = num_rated + excluded.num_rated,
+                rating_sum = rating_sum + excluded.rating_sum;'''
+
+_REVIEWER_REMOVE = '''UPDATE reviewer_stats SET
+                num_reviews = num_reviews - 1,
+                num_rated = num_rated - ({r}.rating IS NOT NULL),
+                rating_sum = rating_sum - COALESCE({r}.rating, 0)
+            WHERE userID = {r}.userID;
+            DELETE FROM reviewer_stats WHERE userID = {r}.userID AND num_reviews <= 0;'''
+
+
+def _histogram_add(r):
+    return '\n'.join(f'''INSERT INTO rating_histogram (period, bucket, rating, num_reviews)
+            SELECT '{period}', {_bucket(period, f'{r}.review_date')}, {r}.rating, 1
+            WHERE {r}.rating IS NOT NULL AND {_bucket(period, f'{r}.review_date')} IS NOT NULL
+            ON CONFLICT(period, bucket, rating) DO UPDATE SET num_reviews = num_reviews + 1;''' for period in PERIODS)
+
+
+def _histogram_remove(r):
+    return '\n'.join(f'''UPDATE rating_histogram SET num_reviews = num_reviews - 1
+            WHERE period = '{period}' AND bucket = {_bucket(period, f'{r}.review_date')} AND rating = {r}.rating;
+            DELETE FROM rating_histogram
+            WHERE period = '{period}' AND bucket = {_bucket(period, f'{r}.review_date')} AND rating = {r}.rating
+              AND num_reviews <= 0;''' for period in PERIODS)
+
+
+LEADERBOARD_TRIGGERS = [
+    # book_stats already follows every review change, so scores follow book_stats
+    f'''CREATE TRIGGER IF NOT EXISTS leaderboard_stats_insert AFTER INSERT ON book_stats
+        BEGIN
+            {_SCORE.format(s='NEW')}
+        END''',
+    f'''CREATE TRIGGER IF NOT EXISTS leaderboard_stats_update AFTER UPDATE ON book_stats
+        BEGIN
+            {_SCORE.format(s='NEW')}
+        END''',
+    '''CREATE TRIGGER IF NOT EXISTS leaderboard_stats_delete AFTER DELETE ON book_stats
+        BEGIN
+            DELETE FROM book_scores WHERE bookID = OLD.bookID;
+        END''',
+    '''CREATE TRIGGER IF NOT EXISTS leaderboard_book_genre AFTER UPDATE OF genreID ON books
+        BEGIN
+            UPDATE book_scores SET genreID = NEW.genreID WHERE bookID = NEW.bookID;
+        END''',
+    '''CREATE TRIGGER IF NOT EXISTS leaderboard_book_delete AFTER DELETE ON books
+        BEGIN
+            DELETE FROM book_scores WHERE bookID = OLD.bookID;
+        END''',
+    f'''CREATE TRIGGER IF NOT EXISTS leaderboard_review_insert AFTER INSERT ON reviews
+        BEGIN
+            {_REVIEWER_ADD.format(r='NEW')}
+            {_histogram_add('NEW')}
+        END''',
+    f'''CREATE TRIGGER IF NOT EXISTS leaderboard_review_delete AFTER DELETE ON reviews
+        BEGIN
+            {_REVIEWER_REMOVE.format(r='OLD')}
+            {_histogram_remove('OLD')}
+        END''',
+    f'''CREATE TRIGGER IF NOT EXISTS leaderboard_review_update AFTER UPDATE OF userID, rating, review_date ON reviews
+        BEGIN
+            {_REVIEWER_REMOVE.format(r='OLD')}
+            {_histogram_remove('OLD')}
+            {_REVIEWER_ADD.format(r='NEW')}
+            {_histogram_add('NEW')}
+        END''',
+    '''CREATE TRIGGER IF NOT EXISTS leaderboard_user_delete AFTER DELETE ON users
+        BEGIN
+            DELETE FROM reviewer_stats WHERE userID = OLD.userID;
+        END''',
+]
+
+_BOOK_SCORES = '''SELECT S.bookID, B.genreID, S.num_rated, (P.weight * P.mean + S.rating_sum) / (P.weight + S.num_rated)
+                  FROM book_stats S JOIN books B ON B.bookID = S.bookID, leaderboard_prior P
+                  WHERE S.num_rated > 0'''
+
+_REVIEWER_STATS = '''SELECT userID, COUNT(*), COUNT(rating), COALESCE(SUM(rating), 0)
+                     FROM reviews WHERE userID IS NOT NULL AND userID IN (SELECT userID FROM users)
+                     GROUP BY userID'''
+
+
+def _histogram(period):
+    return f'''SELECT '{period}', {_bucket(period, 'review_date')} AS bucket, rating, COUNT(*)
+               FROM reviews WHERE rating IS NOT NULL AND bucket IS NOT NULL
+               GROUP BY bucket, rating'''
+
+
+def ensure_leaderboards(c):
+    # creates the tables and triggers; backfills when the tables are new
+    c.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'book_scores'")
+    existed = c.fetchone() is not None
+    for statement in LEADERBOARD_SCHEMA + LEADERBOARD_TRIGGERS:
+        c.execute(statement)
+    if not existed:
+        backfill_leaderboards(c)
+
+
+def backfill_leaderboards(c):
+    # recomputes the prior mean and every table from reviews; returns row counts
+    c.execute("SELECT AVG(rating) FROM reviews")
+    mean = c.fetchone()[0]
+    c.execute("INSERT OR REPLACE INTO leaderboard_prior (id, mean, weight) VALUES (1, ?, ?)",
+              (DEFAULT_MEAN if mean is None else mean, PRIOR_WEIGHT))
+
+    counts = {}
+    c.execute("DELETE FROM book_scores")
+    c.execute(f"INSERT INTO book_scores (bookID, genreID, num_rated, bayes_rating) {_BOOK_SCORES}")
+    counts["book_scores"] = c.rowcount
+    c.execute("DELETE FROM reviewer_stats")
+    c.execute(f"INSERT INTO reviewer_stats (userID, num_reviews, num_rated, rating_sum) {_REVIEWER_STATS}")
+    counts["reviewer_stats"] = c.rowcount
+    c.execute("DELETE FROM rating_histogram")
+    counts["rating_histogram"] = 0
+    for period in PERIODS:
+        c.execute(f"INSERT INTO rating_histogram (period, bucket, rating, num_reviews) {_histogram(period)}")
+        counts["rating_histogram"] += c.rowcount
+    return counts
+
+
+def verify_leaderboards(c):
+    # returns (table, key, stored, expected) for every row that has drifted
+    checks = [
+        ('book_scores', _BOOK_SCORES, "SELECT bookID, genreID, num_rated, bayes_rating FROM book_scores", 1),
+        ('reviewer_stats', _REVIEWER_STATS,
+         "SELECT userID, num_reviews, num_rated, rating_sum FROM reviewer_stats", 1),
+        ('rating_histogram', ' UNION ALL '.join(_histogram(period) for period in PERIODS),
+         "SELECT period, bucket, rating, num_reviews FROM rating_histogram", 3),
+    ]
+    mismatches = []
+    for table, expected_query, stored_query, key_columns in checks:
+        c.execute(expected_query)
+        expected = {row[:key_columns]: row[key_columns:] for row in c.fetchall()}
+        c.execute(stored_query)
+        stored = {row[:key_columns]: row[key_columns:] for row in c.fetchall()}
+        for key in sorted(expected.keys() | stored.keys()):
+            want = expected.get(key)
+            have = stored.get(key)
+            if want is None or have is None or len(want) != len(have) \
+                    or not all(close(a, b) for a, b in zip(want, have)):
+                mismatches.append((table, key, have, want))
+    return mismatches
+
+
+# READS
+
+TOP_BOOKS_QUERY = '''SELECT S.bookID, B.book_name, B.author_name, B.genre_name, B.avg_rating, S.num_rated, S.bayes_rating
+                     FROM book_scores S JOIN book_search B ON B.bookID = S.bookID
+                     WHERE S.genreID = ? ORDER BY S.bayes_rating DESC, S.bookID LIMIT ?'''
+
+# CROSS JOIN keeps reviewer_stats as the outer loop, so the count index is read
+# in order and stops after LIMIT rows instead of sorting every user
+TOP_REVIEWERS_QUERY = '''SELECT R.userID, U.username, R.num_reviews,
+                                CASE WHEN R.num_rated > 0 THEN R.rating_sum / R.num_rated END
+                         FROM reviewer_stats R CROSS JOIN users U ON U.userID = R.userID
+                         ORDER BY R.num_reviews DESC, R.userID LIMIT ?'''
+
+
+def top_books(c, limit, genre=None):
+    # {genre_name: [book rows, best first]} for every genre, or just the one named
+    if genre is None:
+        c.execute("SELECT genreID, genre_name FROM genres ORDER BY genre_name")
+    else:
+        c.execute("SELECT genreID, genre_name FROM genres WHERE genre_name = ?", (genre,))
+    books = {}
+    for genreID, name in c.fetchall():
+        c.execute(TOP_BOOKS_QUERY, (genreID, limit))
+        books[name] = c.fetchall()
+    return books
+
+
+def top_reviewers(c, limit):
+    c.execute(TOP_REVIEWERS_QUERY, (limit,))
+    return c.fetchall()
+
+
+def rating_histogram(c, period, start=None, end=None):
+    # [(bucket, rating, num_reviews)] oldest first; start and end are inclusive
+    # buckets in the period's format ('2024-03-05' or '2024-03')
+    if period not in PERIODS:
+        raise ValueError(f"period must be one of {', '.join(PERIODS)}")
+    query = "SELECT bucket, rating, num_reviews FROM rating_histogram WHERE period = ?"
+    args = (period, )
+    if start:
+        query += " AND bucket >= ?"
+        args += (start, )
+    if end:
+        query += " AND bucket <= ?"
+        args += (end, )
+    c.execute(query + " ORDER BY bucket, rating", args)
+    return c.fetchall()
+
+
+if __name__ == '__main__':
+    run_cli("Backfill or verify the leaderboard tables.", ensure_leaderboards,
+            lambda c: ', '.join(f"{count} {table} rows" for table, count in backfill_leaderboards(c).items()),
+            lambda c: [f"{table} {key}: stored {have}, expected {want}"
+                       for table, key, have, want in verify_leaderboards(c)],
+            rebuild_command='backfill', counting='rows')
@@ -1,202 +1,282 @@
+import os
 from flask import Flask, request, jsonify
 from flask_cors import CORS
-import sqlite3
+from db import ConnectionPool
+from pagination import page_args, paged_response, NEXT_CURSOR_HEADER
+from streaming import wants_ndjson, ndjson_response
+from search import match_query, search_books, search_reviews
+from book_search import parse_filters, books_query, facet_counts
+from batch import parse_batch_body, insert_batch, parse_id_list, delete_batch
+from recommend import similar_books, recommendations, Refresher, TOP_K
+from snapshot import Snapshot
+from leaderboards import top_books, top_reviewers, rating_histogram
+from ingest import ReviewQueue, QueueFull, QueueClosed
+from cache import ResponseCache
+from migrations import migrate
+from instrumentation import Metrics
+from encoding import response_format, compress_response
 
 app = Flask(__name__)
-CORS(app)
+CORS(app, expose_headers=[NEXT_CURSOR_HEADER, 'ETag', 'Server-Timing'])
 DB_FILE = 'backend/database.db'
-
-#CREATES
-
-def create_tables():
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-
-    # create user table
-    c.execute('''CREATE TABLE IF NOT EXISTS users (
-                    userID INTEGER PRIMARY KEY AUTOINCREMENT,
-                    username TEXT,
-                    email TEXT, 
-                    join_date DATE, 
-                    bio TEXT
-                )''')
-    
-    # create books table
-    c.execute(''' CREATE TABLE IF NOT EXISTS books (
-                    bookID INTEGER PRIMARY KEY AUTOINCREMENT,
-                    book_name TEXT,
-                    authorID INTEGER,
-                    genreID INTEGER,
-                    synopsis TEXT,
-                    FOREIGN KEY (authorID) REFERENCES authors (authorID), 
-                    FOREIGN KEY (genreID) REFERENCES genres (genreID)
-              )''')
-    
-    # create reviews table
-    c.execute(''' CREATE TABLE IF NOT EXISTS reviews (
-                    reviewID INTEGER PRIMARY KEY AUTOINCREMENT,
-                    userID INTEGER,
-                    bookID INTEGER,
-                    rating INTEGER, 
-                    review TEXT, 
-                    review_date DATE,
-                    FOREIGN KEY (userID) REFERENCES users (userID), 
-                    FOREIGN KEY (bookID) REFERENCES books (bookID)
-              )''')
-    
-    # create genres table
-    c.execute(''' CREATE TABLE IF NOT EXISTS genres (
-                   genreID INTEGER PRIMARY KEY, 
-                   genre_name TEXT
-              )''')
-    
-    # create authors table
-    c.execute(''' CREATE TABLE IF NOT EXISTS authors (
-                   authorID INTEGER PRIMARY KEY, 
-                   author_name TEXT
-              )''')
-    
-    conn.commit()
-    conn.close()
-
-def initialize_indexes():
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-
-    c.execute('''CREATE INDEX IF NOT EXISTS author_name_idx ON authors(author_name)''')
-    c.execute('''CREATE INDEX IF NOT EXISTS rating_idx ON reviews(rating)''')
-    c.execute('''CREATE INDEX IF NOT EXISTS title_idx ON books(book_name)''')
-    c.execute('''CREATE INDEX IF NOT EXISTS genres_idx ON genres(genre_name)''')
-    c.execute('''CREATE INDEX IF NOT EXISTS review_idx ON reviews(reviewID)''')
-    
-    conn.commit()
-    conn.close()
+pool = ConnectionPool(DB_FILE, max_connections=8, journal_mode='WAL', synchronous='NORMAL',
+                      cache_size=-16000, mmap_size=256 * 1024 * 1024, busy_timeout=5000)
+cache = ResponseCache(max_bytes=32 * 1024 * 1024, max_entries=1024, ttl=300, variant=response_format)
+metrics = Metrics.from_env()
+metrics.install(app)
+app.after_request(compress_response)
+metrics.register_gauges('pool', lambda: pool.metrics(), "Connection pool state.")
+metrics.register_gauges('cache', lambda: cache.metrics(), "Response cache state.")
+# recomputes the similarity of books whose reviews changed (started in __main__ / asgi.py)
+refresher = Refresher(lambda: pool, interval=float(os.environ.get('RECOMMEND_REFRESH_SECONDS', 60)))
+metrics.register_gauges('recommend', lambda: refresher.metrics(), "Recommendation refresh state.")
+# NDJSON exports read from here instead of the main pool; see snapshot.py
+snapshot = Snapshot(lambda: pool, mode=os.environ.get('SNAPSHOT_MODE', 'wal'),
+                    interval=float(os.environ.get('SNAPSHOT_REFRESH_SECONDS', 300)))
+metrics.register_gauges('snapshot', lambda: snapshot.metrics(), "Export snapshot state.")
+# POST /api/reviews writes through this queue; see ingest.py
+def observe_review_batch(rows, seconds):
+    metrics.observe('ingest_batch_rows', (), rows)
+    metrics.observe('ingest_commit_seconds', (), seconds)
+
+review_queue = ReviewQueue(lambda: pool, max_batch=int(os.environ.get('INGEST_BATCH_ROWS', 100)),
+                           max_delay=float(os.environ.get('INGEST_BATCH_MS', 10)) / 1000,
+                           max_pending=int(os.environ.get('INGEST_MAX_PENDING', 10000)),
+                           on_commit=lambda: cache.invalidate('reviews'), observer=observe_review_batch)
+metrics.register_gauges('ingest', lambda: review_queue.metrics(), "Review ingestion queue state.")
+# how long POST /api/reviews waits for its batch before answering 202 anyway:
+# one group-commit interval plus a margin for the commit itself, so a stalled
+# writer can't hold every request thread
+SUBMIT_WAIT = review_queue.max_delay + float(os.environ.get('INGEST_WAIT_MARGIN_MS', 250)) / 1000
 
 @app.route('/api/users', methods=['GET'])
 def get_users():
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
     try:
-        c.execute("PRAGMA read_uncommitted = 1")
-        c.execute("BEGIN TRANSACTION")
-        c.execute('SELECT * FROM users')
-        users = c.fetchall()
-        c.execute("COMMIT")
-        conn.close()
-        return jsonify(users)
+        streaming = wants_ndjson()
+        limit, after = page_args(streaming)
+        query = 'SELECT * FROM users WHERE userID > ? ORDER BY userID LIMIT ?'
+        if streaming:
+            return ndjson_response(snapshot.pool(), query, (after, limit))
+        with pool.transaction() as c:
+            c.execute(query, (after, limit + 1))
+            users = c.fetchall()
+        return paged_response(users, limit)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
-        c.execute("ROLLBACK")
-        conn.close()
         return jsonify({"error": str(e)}), 500
 
 
+def unfiltered_books():
+    # only the plain catalog listing is cached; filtered queries go straight to sqlite.
+    # format only picks the encoding, which the cache keys on
+    return all(k in ('limit', 'cursor', 'facets', 'format') for k, v in request.args.items(multi=True) if len(v) != 0)
+
 @app.route('/api/books', methods=['GET'])
+@cache.cached('books', 'authors', 'genres', 'reviews', when=unfiltered_books)
 def get_books():
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
     try:
-        c.execute("PRAGMA read_uncommitted = 1")
-        c.execute("BEGIN TRANSACTION")
-        conditional = "WHERE"
-        args = tuple()
-        genres = []
-        
-        for v in request.args.getlist("genres[]"):
-            if len(v) != 0:
-                genres.append(v)
-
-        for genre in genres:
-            conditional += " G.genre_name = ? OR"
-            args += (genre, )
-        
-        if conditional != "WHERE":
-            conditional = conditional[:-2]
-            conditional += "AND"
-
-        for q, v in request.args.items():
-            if (q != "genres[]"):
-                if (q == "bookName") and (len(v)!=0):
-                    q = "book_name"
-                    conditional += f" B.{q} = ? AND"
-                    args += (v,)
-                elif (q == "avg_rating" or q == 'num_rating') and (len(v)!=0):
-                    conditional+=f" {q} > ? AND"
-                    args += (float(v), )
-                elif (q == "authorName") and (len(v)!=0):
-                    q = "author_name"
-                    conditional += f" A.{q} = ? AND"
-                    args += (v,)
-
-        if (conditional != "WHERE"):
-            conditional = conditional[:-3]
-        else:
-            conditional = ""
-        
-        query = f'''SELECT B.bookID, B.book_name, A.author_name, G.genre_name, B.synopsis,
-                (SELECT AVG(rating) FROM reviews WHERE bookID=B.bookID) AS avg_rating,
-                (SELECT COUNT(*) FROM reviews WHERE bookID=B.bookID) AS num_rating
-                FROM books B JOIN authors A ON A.authorID = B.authorID JOIN genres G ON g.genreID = b.genreID {conditional}'''
-
-        c.execute(query, args)
-        books = c.fetchall()
-        c.execute("COMMIT")
-        conn.close()
-        return jsonify(books)
+        streaming = wants_ndjson()
+        limit, after = page_args(streaming)
+        filters = parse_filters(request.args)
+        query, args = books_query(filters, after)
+        if streaming:
+            return ndjson_response(snapshot.pool(), query, args + (limit, ))
+
+        # ?facets=1 wraps the page as {"books": [...], "facets": {...}} with the
+        # genre and author counts for the current filters. later pages share the
+        # first page's counts, so they come back with "facets": null
+        with_facets = request.args.get('facets') == '1'
+        facets = None
+        with pool.transaction() as c:
+            c.execute(query, args + (limit + 1, ))
+            books = c.fetchall()
+            if with_facets and request.args.get('cursor') is None:
+                facets = facet_counts(c, filters)
+        if with_facets:
+            return paged_response(books, limit, wrap=lambda page: {"books": page, "facets": facets})
+        return paged_response(books, limit)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
-        c.execute("ROLLBACK")
-        conn.close()
         return jsonify({"error": str(e)}), 500
 
 @app.route('/api/reviews', methods=['GET'])
 def get_reviews():
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
     try:
-        c.execute("PRAGMA read_uncommitted = 1")
-        c.execute("BEGIN TRANSACTION")
-        c.execute('SELECT R.reviewID, U.username, B.book_name, R.rating, R.review, R.review_date FROM reviews R JOIN users U ON U.userID = R.userID JOIN books B ON B.bookID = R.bookID')
-        reviews = c.fetchall()
-        c.execute("COMMIT")
-        conn.close()
-        return jsonify(reviews)
+        streaming = wants_ndjson()
+        limit, after = page_args(streaming)
+        query = '''SELECT R.reviewID, U.username, B.book_name, R.rating, R.review, R.review_date
+                   FROM reviews R JOIN users U ON U.userID = R.userID JOIN books B ON B.bookID = R.bookID
+                   WHERE R.reviewID > ? ORDER BY R.reviewID LIMIT ?'''
+        if streaming:
+            return ndjson_response(snapshot.pool(), query, (after, limit))
+        with pool.transaction() as c:
+            c.execute(query, (after, limit + 1))
+            reviews = c.fetchall()
+        return paged_response(reviews, limit)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
-        c.execute("ROLLBACK")
-        conn.close()
         return jsonify({"error": str(e)}), 500
 
 
 @app.route('/api/genres', methods=['GET'])
+@cache.cached('genres')
 def get_genres():
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
     try:
-        c.execute("PRAGMA read_uncommitted = 1")
-        c.execute("BEGIN TRANSACTION")
-        c.execute('SELECT * FROM genres')
-        genres = c.fetchall()
-        c.execute("COMMIT")
-        conn.close()
-        return jsonify(genres)
+        streaming = wants_ndjson()
+        limit, after = page_args(streaming)
+        query = 'SELECT * FROM genres WHERE genreID > ? ORDER BY genreID LIMIT ?'
+        if streaming:
+            return ndjson_response(snapshot.pool(), query, (after, limit))
+        with pool.transaction() as c:
+            c.execute(query, (after, limit + 1))
+            genres = c.fetchall()
+        return paged_response(genres, limit)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
-        c.execute("ROLLBACK")
-        conn.close()
         return jsonify({"error": str(e)}), 500
 
 @app.route('/api/authors', methods=['GET'])
+@cache.cached('authors')
 def get_authors():
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
     try:
-        c.execute("PRAGMA read_uncommitted = 1")
-        c.execute("BEGIN TRANSACTION")
-        c.execute('SELECT * FROM authors')
-        authors = c.fetchall()
-        c.execute("COMMIT")
-        conn.close()
-        return jsonify(authors)
+        streaming = wants_ndjson()
+        limit, after = page_args(streaming)
+        query = 'SELECT * FROM authors WHERE authorID > ? ORDER BY authorID LIMIT ?'
+        if streaming:
+            return ndjson_response(snapshot.pool(), query, (after, limit))
+        with pool.transaction() as c:
+            c.execute(query, (after, limit + 1))
+            authors = c.fetchall()
+        return paged_response(authors, limit)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+# limit for routes that return a short list rather than a page
+def small_limit(maximum, default=10):
+    limit = request.args.get('limit', '')
+    limit = min(int(limit), maximum) if len(limit) != 0 else default
+    if limit < 1:
+        raise ValueError("limit must be positive")
+    return limit
+
+@app.route('/api/search', methods=['GET'])
+def search():
+    try:
+        match = match_query(request.args.get('q', ''))
+        kind = request.args.get('type', 'all')
+        if kind not in ('all', 'books', 'reviews'):
+            return jsonify({"error": "type must be all, books or reviews"}), 400
+        limit = small_limit(100, default=20)
+
+        results = {}
+        with pool.transaction() as c:
+            if kind in ('all', 'books'):
+                results["books"] = search_books(c, match, limit)
+            if kind in ('all', 'reviews'):
+                results["reviews"] = search_reviews(c, match, limit)
+        return jsonify(results)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+# RECOMMENDATIONS
+# both read the precomputed book_neighbors table; see recommend.py
+
+@app.route('/api/books/<int:book_id>/similar', methods=['GET'])
+def get_similar_books(book_id):
+    try:
+        limit = small_limit(TOP_K)
+        with pool.transaction() as c:
+            books = similar_books(c, book_id, limit)
+        return jsonify(books)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/users/<int:user_id>/recommendations', methods=['GET'])
+def get_recommendations(user_id):
+    try:
+        limit = small_limit(TOP_K)
+        with pool.transaction() as c:
+            books = recommendations(c, user_id, limit)
+        return jsonify(books)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+# LEADERBOARDS
+# served from the tables leaderboards.py keeps up to date
+
+@app.route('/api/leaderboards/books', methods=['GET'])
+@cache.cached('books', 'authors', 'genres', 'reviews')
+def get_top_books():
+    try:
+        limit = small_limit(100)
+        genre = request.args.get('genre') or None
+        with pool.transaction() as c:
+            books = top_books(c, limit, genre)
+        return jsonify(books)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/leaderboards/reviewers', methods=['GET'])
+@cache.cached('users', 'reviews')
+def get_top_reviewers():
+    try:
+        limit = small_limit(100)
+        with pool.transaction() as c:
+            reviewers = top_reviewers(c, limit)
+        return jsonify(reviewers)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/stats/ratings', methods=['GET'])
+@cache.cached('reviews')
+def get_rating_histogram():
+    try:
+        period = request.args.get('period', 'month')
+        with pool.transaction() as c:
+            histogram = rating_histogram(c, period, request.args.get('from'), request.args.get('to'))
+        return jsonify(histogram)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/pool', methods=['GET'])
+def get_pool_metrics():
+    return jsonify(pool.metrics())
+
+@app.route('/api/cache', methods=['GET'])
+def get_cache_metrics():
+    return jsonify(cache.metrics())
+
+@app.route('/api/snapshot', methods=['GET'])
+def get_snapshot_metrics():
+    return jsonify(dict(snapshot.metrics(), mode=snapshot.mode))
+
+@app.route('/api/snapshot/refresh', methods=['POST'])
+def refresh_snapshot():
+    # takes a fresh copy now instead of waiting for the next interval
+    try:
+        if snapshot.mode != 'backup':
+            return jsonify({"error": f"snapshot mode is {snapshot.mode}, nothing to refresh"}), 400
+        snapshot.refresh()
+        return jsonify(dict(snapshot.metrics(), mode=snapshot.mode))
     except Exception as e:
-        c.execute("ROLLBACK")
-        conn.close()
         return jsonify({"error": str(e)}), 500
 
 
@@ -207,7 +287,6 @@ def get_authors():
 def post_added_users():
     try:
         data = request.json
-        print(data)
         username = data.get('username')
         email = data.get('email')
         join_date = data.get('join_date')
@@ -216,23 +295,15 @@ def post_added_users():
         if '@' not in email:
             return jsonify({"error": "Invalid email format"}), 400
 
-        conn = sqlite3.connect(DB_FILE)
-        c = conn.cursor()
-        c.execute("PRAGMA read_uncommitted = 1")
-        c.execute("BEGIN TRANSACTION")
-
-        c.execute("INSERT INTO users (username, email, join_date, bio) VALUES (?, ?, ?, ?)",
-                  (username, email, join_date, bio))
-        c.execute("COMMIT") 
-        conn.commit()
-        conn.close()
+        with pool.transaction(write=True) as c:
+            c.execute("INSERT INTO users (username, email, join_date, bio) VALUES (?, ?, ?, ?)",
+                      (username, email, join_date, bio))
 
+        cache.invalidate('users')
         return jsonify({"message": "User added successfully"}), 200
     except Exception as e:
-        c.execute("ROLLBACK")
-        conn.close()
         return jsonify({"error": str(e)}), 500
-    
+
 @app.route('/api/books', methods=["POST"])
 def post_added_books():
     try:
@@ -242,219 +313,231 @@ def post_added_books():
         genre = data.get('genreName')
         synopsis = data.get('synopsis')
 
-        conn = sqlite3.connect(DB_FILE)
-        c = conn.cursor()
-        c.execute("PRAGMA read_uncommitted = 1")
-        c.execute("BEGIN TRANSACTION")
-
-        c.execute('''INSERT INTO books (book_name, authorID, genreID, synopsis)
-                        VALUES (?, (SELECT min(authorID) FROM authors WHERE author_name = ?), (SELECT min(genreID) FROM genres WHERE genre_name = ?), ?)''',
-                  (book, author, genre, synopsis))
-        c.execute("COMMIT")
-        conn.commit()
-        conn.close()
+        with pool.transaction(write=True) as c:
+            c.execute('''INSERT INTO books (book_name, authorID, genreID, synopsis)
+                            VALUES (?, (SELECT min(authorID) FROM authors WHERE author_name = ?), (SELECT min(genreID) FROM genres WHERE genre_name = ?), ?)''',
+                      (book, author, genre, synopsis))
 
+        cache.invalidate('books')
         return jsonify({"message": "Book added successfully"}), 200
     except Exception as e:
-        c.execute("ROLLBACK")
-        conn.close()
         return jsonify({"error": str(e)}), 500
-    
+
 @app.route('/api/reviews', methods=["POST"])
 def post_added_reviews():
+    # reviews are group-committed by review_queue. this waits up to SUBMIT_WAIT
+    # for the commit and answers as before; past that, or straight away when the
+    # client sends "Prefer: respond-async", it gets a 202 with the submission to
+    # poll. an Idempotency-Key header makes retries return the first submission
+    # instead of a new review
     try:
         data = request.json
-        print(data)
-        user = data.get('userName')
-        book = data.get('bookName')
-        rating = data.get('rating')
-        review = data.get('review')
-        review_date = data.get('review_date')
-
-        conn = sqlite3.connect(DB_FILE)
-        c = conn.cursor()
-
-        c.execute("PRAGMA read_uncommitted = 1")
-        c.execute("BEGIN TRANSACTION")
-        c.execute('''INSERT INTO reviews (userID, bookID, rating, review, review_date) 
-                        VALUES ((SELECT min(userID) FROM users WHERE username = ?), (SELECT min(bookID) FROM books WHERE book_name = ?), ?, ?, ?)''',
-                  (user, book, rating, review, review_date))
-        c.execute("COMMIT")
-        conn.commit()
-        conn.close()
-
-        return jsonify({"message": "Review added successfully"}), 200
+        key = request.headers.get('Idempotency-Key') or None
+        submission, created = review_queue.submit(data, key)
+
+        if 'respond-async' not in request.headers.get('Prefer', '') and submission.wait(SUBMIT_WAIT):
+            if submission.status == 'failed':
+                return jsonify({"error": submission.error}), 500
+            return jsonify(dict(submission.as_dict(), message="Review added successfully")), 200
+        response = jsonify(submission.as_dict())
+        response.headers['Location'] = f"/api/reviews/submissions/{submission.id}"
+        return response, 202
+    except (QueueFull, QueueClosed) as e:
+        return jsonify({"error": str(e)}), 503, {'Retry-After': '1'}
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/reviews/submissions/<submission_id>', methods=['GET'])
+def get_review_submission(submission_id):
+    try:
+        submission = review_queue.lookup(submission_id)
+        if submission is None:
+            return jsonify({"error": "unknown submission"}), 404
+        return jsonify(submission.as_dict())
     except Exception as e:
-        c.execute("ROLLBACK")
-        conn.close()
         return jsonify({"error": str(e)}), 500
 
 @app.route('/api/genres', methods=["POST"])
 def post_added_genres():
     try:
         data = request.json
-        print(data)
         genre_name = data.get('genre_name')
-        conn = sqlite3.connect(DB_FILE)
-        c = conn.cursor()
-        c.execute("PRAGMA read_uncommitted = 1")
-        c.execute("BEGIN TRANSACTION")
-        c.execute("INSERT INTO genres (genre_name) VALUES (?)",
-                  (genre_name,))
-        c.execute("COMMIT")
-        conn.commit()
-        conn.close()
+        with pool.transaction(write=True) as c:
+            c.execute("INSERT INTO genres (genre_name) VALUES (?)",
+                      (genre_name,))
 
+        cache.invalidate('genres')
         return jsonify({"message": "Genre added successfully"}), 200
     except Exception as e:
-        c.execute("ROLLBACK")
-        conn.close()
         return jsonify({"error": str(e)}), 500
 
 @app.route('/api/authors', methods=["POST"])
 def post_added_authors():
     try:
         data = request.json
-        print(data)
         author_name = data.get('author_name')
-        conn = sqlite3.connect(DB_FILE)
-        c = conn.cursor()
-        c.execute("PRAGMA read_uncommitted = 1")
-        c.execute("BEGIN TRANSACTION")
-        c.execute("INSERT INTO authors (author_name) VALUES (?)",
-                  (author_name,))
-        c.execute("COMMIT") 
-        conn.commit()
-        conn.close()
+        with pool.transaction(write=True) as c:
+            c.execute("INSERT INTO authors (author_name) VALUES (?)",
+                      (author_name,))
 
+        cache.invalidate('authors')
         return jsonify({"message": "Author added successfully"}), 200
     except Exception as e:
-        c.execute("ROLLBACK")
-        conn.close()
         return jsonify({"error": str(e)}), 500
-    
 
-# DELETES 
-    
-@app.route('/api/users/<int:user_id>', methods=['DELETE'])
-def delete_user(user_id):
+# BATCH ADDS
+
+def post_batch(entity):
     try:
-        conn = sqlite3.connect(DB_FILE)
-        c = conn.cursor()
-        c.execute("PRAGMA read_uncommitted = 1")
-        c.execute("BEGIN TRANSACTION")
-        c.execute("DELETE FROM users WHERE userID = ?", (user_id,))
-        c.execute("COMMIT")
-        conn.commit()
-        conn.close()
-        return jsonify({"message": "User deleted successfully"}), 200
+        items, errors = parse_batch_body()
+        with pool.transaction(write=True) as c:
+            inserted, row_errors = insert_batch(c, entity, items)
+        cache.invalidate(entity)
+        errors = sorted(errors + row_errors, key=lambda error: error["index"])
+        return jsonify({"inserted": inserted, "errors": errors}), 200
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
-        c.execute("ROLLBACK")
-        conn.close()
         return jsonify({"error": str(e)}), 500
-    
-@app.route('/api/books/<int:book_id>', methods=['DELETE'])
-def delete_book(book_id):
+
+@app.route('/api/users/batch', methods=["POST"])
+def post_batch_users():
+    return post_batch('users')
+
+@app.route('/api/books/batch', methods=["POST"])
+def post_batch_books():
+    return post_batch('books')
+
+@app.route('/api/reviews/batch', methods=["POST"])
+def post_batch_reviews():
+    return post_batch('reviews')
+
+@app.route('/api/genres/batch', methods=["POST"])
+def post_batch_genres():
+    return post_batch('genres')
+
+@app.route('/api/authors/batch', methods=["POST"])
+def post_batch_authors():
+    return post_batch('authors')
+
+
+# DELETES
+# users and books take their reviews with them; see batch.BATCH_DELETES
+
+# cache tags touched by deleting each entity
+DELETE_TAGS = {
+    'users': ('users', 'reviews'),
+    'books': ('books', 'reviews'),
+    'reviews': ('reviews',),
+    'genres': ('genres', 'books'),
+    'authors': ('authors', 'books'),
+}
+
+def delete_one(entity, row_id, message):
     try:
-        conn = sqlite3.connect(DB_FILE)
-        c = conn.cursor()
-        c.execute("PRAGMA read_uncommitted = 1")
-        c.execute("BEGIN TRANSACTION")
-        c.execute("DELETE FROM books WHERE bookID = ?", (book_id,))
-        c.execute("COMMIT")
-        conn.commit()
-        conn.close()
-        return jsonify({"message": "Book deleted successfully"}), 200
+        with pool.transaction(write=True) as c:
+            delete_batch(c, entity, [row_id])
+        cache.invalidate(*DELETE_TAGS[entity])
+        return jsonify({"message": message}), 200
     except Exception as e:
-        c.execute("ROLLBACK")
-        conn.close()
         return jsonify({"error": str(e)}), 500
-    
-    
+
+@app.route('/api/users/<int:user_id>', methods=['DELETE'])
+def delete_user(user_id):
+    return delete_one('users', user_id, "User deleted successfully")
+
+@app.route('/api/books/<int:book_id>', methods=['DELETE'])
+def delete_book(book_id):
+    return delete_one('books', book_id, "Book deleted successfully")
+
 @app.route('/api/reviews/<int:review_id>', methods=['DELETE'])
 def delete_review(review_id):
-    try:
-        conn = sqlite3.connect(DB_FILE)
-        c = conn.cursor()
-        c.execute("PRAGMA read_uncommitted = 1")
-        c.execute("BEGIN TRANSACTION")
-        c.execute("DELETE FROM reviews WHERE reviewID = ?", (review_id,))
-        c.execute("COMMIT")
-        conn.commit()
-        conn.close()
-        return jsonify({"message": "Review deleted successfully"}), 200
-    except Exception as e:
-        c.execute("ROLLBACK")
-        conn.close()
-        return jsonify({"error": str(e)}), 500
-    
+    return delete_one('reviews', review_id, "Review deleted successfully")
+
 @app.route('/api/genres/<int:genre_id>', methods=['DELETE'])
 def delete_genre(genre_id):
-    try:
-        conn = sqlite3.connect(DB_FILE)
-        c = conn.cursor()
-        c.execute("PRAGMA read_uncommitted = 1")
-        c.execute("BEGIN TRANSACTION")
-        c.execute("UPDATE books SET genreID = NULL WHERE genreID = ?", (genre_id,))
-        c.execute("DELETE FROM genres WHERE genreID = ?", (genre_id,))
-        c.execute("COMMIT")
-        conn.commit()
-        conn.close()
-        return jsonify({"message": "Genre deleted successfully"}), 200
-    except Exception as e:
-        c.execute("ROLLBACK")
-        conn.close()
-        return jsonify({"error": str(e)}), 500
-    
+    return delete_one('genres', genre_id, "Genre deleted successfully")
+
 @app.route('/api/authors/<int:author_id>', methods=['DELETE'])
 def delete_author(author_id):
+    return delete_one('authors', author_id, "Author deleted successfully")
+
+# BATCH DELETES
+# the body is a JSON array of IDs (or NDJSON, one ID per line); everything is
+# deleted in one transaction and the response counts the rows each table lost
+
+def delete_batch_route(entity):
     try:
-        conn = sqlite3.connect(DB_FILE)
-        c = conn.cursor()
-        c.execute("PRAGMA read_uncommitted = 1")
-        c.execute("BEGIN TRANSACTION")
-        c.execute("UPDATE books SET authorID = NULL WHERE authorID = ?", (author_id,))
-        c.execute("DELETE FROM authors WHERE authorID = ?", (author_id,))
-        c.execute("COMMIT")
-        conn.commit()
-        conn.close()
-        return jsonify({"message": "Author deleted successfully"}), 200
+        items, errors = parse_batch_body()
+        ids, id_errors = parse_id_list(items)
+        with pool.transaction(write=True) as c:
+            counts = delete_batch(c, entity, ids)
+        cache.invalidate(*DELETE_TAGS[entity])
+        errors = sorted(errors + id_errors, key=lambda error: error["index"])
+        return jsonify(dict(counts, errors=errors)), 200
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
-        c.execute("ROLLBACK")
-        conn.close()
         return jsonify({"error": str(e)}), 500
-    
+
+@app.route('/api/users/batch', methods=["DELETE"])
+def delete_batch_users():
+    return delete_batch_route('users')
+
+@app.route('/api/books/batch', methods=["DELETE"])
+def delete_batch_books():
+    return delete_batch_route('books')
+
+@app.route('/api/reviews/batch', methods=["DELETE"])
+def delete_batch_reviews():
+    return delete_batch_route('reviews')
+
+@app.route('/api/genres/batch', methods=["DELETE"])
+def delete_batch_genres():
+    return delete_batch_route('genres')
+
+@app.route('/api/authors/batch', methods=["DELETE"])
+def delete_batch_authors():
+    return delete_batch_route('authors')
+
 #EDITS
-    
+
 @app.route('/api/users/', methods=["PUT"])
 def edit_user():
     try:
         data = request.json
-        print(data)
         userID = data.get('userID')
         username = data.get('username')
         email = data.get('email')
         join_date = data.get('join_date')
         bio = data.get('bio')
-        
-        conn = sqlite3.connect(DB_FILE)
-        c = conn.cursor()
-        c.execute("PRAGMA read_uncommitted = 1")
-        c.execute("BEGIN TRANSACTION")
-        c.execute("UPDATE users SET username=?, email=?, join_date=?, bio=? WHERE userID=?",
-                  (username, email, join_date, bio, userID))
-        c.execute("COMMIT")
-        conn.commit()
-        conn.close()
 
+        with pool.transaction(write=True) as c:
+            c.execute("UPDATE users SET username=?, email=?, join_date=?, bio=? WHERE userID=?",
+                      (username, email, join_date, bio, userID))
+
+        cache.invalidate('users')
         return jsonify({"message": "User updated successfully"}), 200
     except Exception as e:
-        c.execute("ROLLBACK")
-        conn.close()
         return jsonify({"error": str(e)}), 500
 
 
 if __name__ == '__main__':
-    create_tables()
-    initialize_indexes()
-    app.run(debug=True, port=5001)
+    with pool.connection() as conn:
+        migrate(conn)
+    # debug turns on werkzeug's reloader, which runs this block once more in a
+    # watcher process that never serves; the background threads belong only in
+    # the serving child, which werkzeug marks with WERKZEUG_RUN_MAIN
+    debug = True
+    serving = not debug or os.environ.get('WERKZEUG_RUN_MAIN') == 'true'
+    if serving:
+        refresher.start()
+        snapshot.start()
+        review_queue.start()
+    try:
+        app.run(debug=debug, port=5001)
+    finally:
+        if serving:
+            review_queue.stop()
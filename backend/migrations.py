@@ -0,0 +1,152 @@
+import argparse
+import sqlite3
+from book_stats import ensure_book_stats
+from search import ensure_search_index, update_author_triggers
+from book_search import ensure_book_search
+from recommend import ensure_recommendations
+from leaderboards import ensure_leaderboards
+from ingest import ensure_ingest
+
+# versioned schema migrations. the schema version lives in PRAGMA user_version and
+# each migration runs in its own transaction, so a failed step leaves the database
+# at the last good version. migrations only ever get appended to MIGRATIONS.
+#
+# the first steps use IF NOT EXISTS, so databases created before migrations
+# existed (user_version 0 with the tables already there) upgrade in place.
+
+def _base_tables(c):
+    # create user table
+    c.execute('''CREATE TABLE IF NOT EXISTS users (
+                    userID INTEGER PRIMARY KEY AUTOINCREMENT,
+                    username TEXT,
+                    email TEXT,
+                    join_date DATE,
+                    bio TEXT
+                )''')
+
+    # create books table
+    c.execute(''' CREATE TABLE IF NOT EXISTS books (
+                    bookID INTEGER PRIMARY KEY AUTOINCREMENT,
+                    book_name TEXT,
+                    authorID INTEGER,
+                    genreID INTEGER,
+                    synopsis TEXT,
+                    FOREIGN KEY (authorID) REFERENCES authors (authorID),
+                    FOREIGN KEY (genreID) REFERENCES genres (genreID)
+              )''')
+
+    # create reviews table
+    c.execute(''' CREATE TABLE IF NOT EXISTS reviews (
+                    reviewID INTEGER PRIMARY KEY AUTOINCREMENT,
+                    userID INTEGER,
+                    bookID INTEGER,
+                    rating INTEGER,
+                    review TEXT,
+                    review_date DATE,
+                    FOREIGN KEY (userID) REFERENCES users (userID),
+                    FOREIGN KEY (bookID) REFERENCES books (bookID)
+              )''')
+
+    # create genres table
+    c.execute(''' CREATE TABLE IF NOT EXISTS genres (
+                   genreID INTEGER PRIMARY KEY,
+                   genre_name TEXT
+              )''')
+
+    # create authors table
+    c.execute(''' CREATE TABLE IF NOT EXISTS authors (
+                   authorID INTEGER PRIMARY KEY,
+                   author_name TEXT
+              )''')
+
+
+def _lookup_indexes(c):
+    c.execute('''CREATE INDEX IF NOT EXISTS author_name_idx ON authors(author_name)''')
+    c.execute('''CREATE INDEX IF NOT EXISTS rating_idx ON reviews(rating)''')
+    c.execute('''CREATE INDEX IF NOT EXISTS title_idx ON books(book_name)''')
+    c.execute('''CREATE INDEX IF NOT EXISTS genres_idx ON genres(genre_name)''')
+
+
+# join and foreign-key columns used by get_books, get_reviews, the name lookups
+# in the write routes and the genre/author deletes
+JOIN_INDEXES = {
+    'books_author_idx': 'books(authorID)',
+    'books_genre_idx': 'books(genreID)',
+    'reviews_book_idx': 'reviews(bookID)',
+    'reviews_user_idx': 'reviews(userID)',
+    'username_idx': 'users(username)',
+}
+
+
+def _join_indexes(c):
+    for name, target in JOIN_INDEXES.items():
+        c.execute(f'''CREATE INDEX IF NOT EXISTS {name} ON {target}''')
+    # reviewID is the rowid, so this index only ever cost writes
+    c.execute('''DROP INDEX IF EXISTS review_idx''')
+
+
+MIGRATIONS = [
+    (1, "base tables", _base_tables),
+    (2, "lookup indexes", _lookup_indexes),
+    (3, "book_stats rating aggregates", ensure_book_stats),
+    (4, "full-text search index", ensure_search_index),
+    (5, "join and foreign-key indexes", _join_indexes),
+    (6, "book_search filter table", ensure_book_search),
+    (7, "book_neighbors recommendations", ensure_recommendations),
+    (8, "leaderboard tables", ensure_leaderboards),
+    (9, "review submission log", ensure_ingest),
+    (10, "search triggers for new and renumbered authors", update_author_triggers),
+]
+
+LATEST = MIGRATIONS[-1][0]
+
+
+def current_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn, target=LATEST, log=print):
+    # applies every pending migration up to target; conn must be in autocommit
+    # mode (isolation_level=None), as the pool's connections are. the version is
+    # re-read under the write lock so several processes starting at once (ASGI
+    # workers) apply each migration exactly once
+    version = current_version(conn)
+    for number, name, apply in MIGRATIONS:
+        if number <= version or number > target:
+            continue
+        c = conn.cursor()
+        c.execute("BEGIN IMMEDIATE")
+        try:
+            version = current_version(conn)
+            if number <= version:
+                c.execute("COMMIT")
+                continue
+            apply(c)
+            c.execute(f"PRAGMA user_version = {number}")
+            c.execute("COMMIT")
+        except Exception:
+            c.execute("ROLLBACK")
+            raise
+        finally:
+            c.close()
+        if log:
+            log(f"applied migration {number}: {name}")
+        version = number
+    return version
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Apply or inspect schema migrations.")
+    parser.add_argument('command', nargs='?', choices=['up', 'status'], default='up')
+    parser.add_argument('--db', default='backend/database.db')
+    parser.add_argument('--target', type=int, default=LATEST)
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db, isolation_level=None)
+    if args.command == 'status':
+        version = current_version(conn)
+        for number, name, _ in MIGRATIONS:
+            print(f"{'x' if number <= version else ' '} {number}: {name}")
+    else:
+        print(f"database at version {migrate(conn, args.target)}")
+    conn.close()
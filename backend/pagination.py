@@ -0,0 +1,67 @@
+import base64
+import binascii
+import json
+from flask import request
+from encoding import encoded_response
+
+# keyset pagination for the list routes. a page is "rows whose key is greater
+# than the last key the client saw", so every page is an index range scan on the
+# primary key instead of an OFFSET that re-reads everything before it.
+#
+# the cursor is opaque to clients; the next one comes back in X-Next-Cursor and
+# the header is absent on the last page.
+
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+NEXT_CURSOR_HEADER = 'X-Next-Cursor'
+FIRST_KEY = -(2 ** 63)
+
+
+def encode_cursor(key):
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        return json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise ValueError("Invalid cursor")
+
+
+def page_args(streaming=False):
+    # returns (limit, after_key) from the query string; raises ValueError on bad input.
+    # all list routes page on an integer primary key. streamed responses don't
+    # buffer, so they have no cap and default to -1 (no LIMIT in sqlite)
+    limit = request.args.get('limit', '')
+    if len(limit) == 0:
+        limit = -1 if streaming else DEFAULT_LIMIT
+    else:
+        try:
+            limit = int(limit)
+        except ValueError:
+            raise ValueError("limit must be an integer")
+        if limit < 1:
+            raise ValueError("limit must be positive")
+        if not streaming:
+            limit = min(limit, MAX_LIMIT)
+
+    cursor = request.args.get('cursor', '')
+    if len(cursor) == 0:
+        return limit, FIRST_KEY
+    after = decode_cursor(cursor)
+    if not isinstance(after, int) or isinstance(after, bool):
+        raise ValueError("Invalid cursor")
+    return limit, after
+
+
+def paged_response(rows, limit, key=lambda row: row[0], wrap=None):
+    # rows should be fetched with LIMIT limit + 1 so we know whether a next page exists.
+    # wrap(rows) can turn the page into a larger body (e.g. an object with extras);
+    # the body is encoded in whatever format the client negotiated
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    response = encoded_response(rows, wrap)
+    if has_more:
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(key(rows[-1]))
+    return response
@@ -0,0 +1,332 @@
+import argparse
+import math
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+
+try:
+    import numpy as np
+    from scipy import sparse
+except ImportError:
+    np = sparse = None
+
+# "readers who liked this also liked": item-item similarity over the
+# (userID, bookID, rating) matrix, precomputed into book_neighbors so the API
+# only ever reads a book's top TOP_K neighbors by primary key.
+#
+# a book's vector holds each reviewer's rating minus 3, so 4-5 stars pull books
+# together, 1-2 stars push them apart and 3 is neutral (several reviews by one
+# user of one book are averaged; unrated reviews are ignored). similarity is the
+# cosine of two vectors scaled by n / (n + SHRINK), n being the number of
+# readers who rated both, so pairs seen by one or two readers don't top the list.
+# only positive similarities are kept.
+#
+# rebuild() recomputes everything, vectorized with scipy.sparse when numpy and
+# scipy are installed and in plain python otherwise. review triggers mark the
+# books they touch in recommend_dirty, and refresh() recomputes only those: each
+# dirty book's own list exactly, and its new score inside its neighbors' lists.
+# a neighbor's list can't pick up a book that only moved into its top K because
+# the dirty book moved out, so a periodic rebuild is still worthwhile.
+
+TOP_K = 20
+SHRINK = 10.0
+NEUTRAL = 3.0
+CHUNK = 500
+
+RECOMMEND_SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS book_neighbors (
+            bookID INTEGER NOT NULL,
+            rank INTEGER NOT NULL,
+            neighborID INTEGER NOT NULL,
+            score REAL NOT NULL,
+            PRIMARY KEY (bookID, rank)
+       ) WITHOUT ROWID''',
+    '''CREATE INDEX IF NOT EXISTS book_neighbors_neighbor_idx ON book_neighbors(neighborID)''',
+    '''CREATE TABLE IF NOT EXISTS recommend_dirty (
+            bookID INTEGER PRIMARY KEY
+       )''',
+]
+
+RECOMMEND_TRIGGERS = [
+    '''CREATE TRIGGER IF NOT EXISTS recommend_review_insert AFTER INSERT ON reviews
+        WHEN NEW.bookID IS NOT NULL AND NEW.rating IS NOT NULL
+        BEGIN
+            INSERT OR IGNORE INTO recommend_dirty (bookID) VALUES (NEW.bookID);
+        END''',
+    '''CREATE TRIGGER IF NOT EXISTS recommend_review_delete AFTER DELETE ON reviews
+        WHEN OLD.bookID IS NOT NULL AND OLD.rating IS NOT NULL
+        BEGIN
+            INSERT OR IGNORE INTO recommend_dirty (bookID) VALUES (OLD.bookID);
+        END''',
+    '''CREATE TRIGGER IF NOT EXISTS recommend_review_update AFTER UPDATE OF userID, bookID, rating ON reviews
+        BEGIN
+            INSERT OR IGNORE INTO recommend_dirty (bookID) SELECT OLD.bookID WHERE OLD.bookID IS NOT NULL;
+            INSERT OR IGNORE INTO recommend_dirty (bookID) SELECT NEW.bookID WHERE NEW.bookID IS NOT NULL;
+        END''',
+    '''CREATE TRIGGER IF NOT EXISTS recommend_book_delete AFTER DELETE ON books
+        BEGIN
+            DELETE FROM book_neighbors WHERE bookID = OLD.bookID;
+            DELETE FROM book_neighbors WHERE neighborID = OLD.bookID;
+            DELETE FROM recommend_dirty WHERE bookID = OLD.bookID;
+        END''',
+]
+
+_RATINGS = '''SELECT userID, bookID, AVG(rating) - {neutral} FROM reviews
+              WHERE rating IS NOT NULL AND userID IS NOT NULL AND bookID IS NOT NULL {{where}}
+              GROUP BY userID, bookID'''.format(neutral=NEUTRAL)
+
+
+def ensure_recommendations(c):
+    # creates the tables and triggers; builds the neighbors when the table is new
+    c.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'book_neighbors'")
+    existed = c.fetchone() is not None
+    for statement in RECOMMEND_SCHEMA + RECOMMEND_TRIGGERS:
+        c.execute(statement)
+    if not existed:
+        rebuild(c)
+
+
+def _chunks(ids):
+    ids = list(ids)
+    for start in range(0, len(ids), CHUNK):
+        yield ids[start:start + CHUNK]
+
+
+def _ratings(c, column=None, ids=None):
+    # [(userID, bookID, centered rating)], optionally only for some users or books
+    if column is None:
+        c.execute(_RATINGS.format(where=''))
+        return c.fetchall()
+    rows = []
+    for chunk in _chunks(ids):
+        c.execute(_RATINGS.format(where=f"AND {column} IN ({', '.join('?' for _ in chunk)})"), chunk)
+        rows.extend(c.fetchall())
+    return rows
+
+
+def _top(scores, k=TOP_K):
+    # {neighborID: score} -> best k positive (neighborID, score), ties by ID
+    best = sorted(((-score, neighbor) for neighbor, score in scores.items() if score > 0))[:k]
+    return [(neighbor, -negative) for negative, neighbor in best]
+
+
+def _scores(book, by_book, by_user, norms):
+    # {neighborID: similarity} for every book sharing a reader with book
+    acc = {}
+    for user, value in by_book[book]:
+        for other, other_value in by_user[user]:
+            if other == book:
+                continue
+            entry = acc.get(other)
+            if entry is None:
+                acc[other] = [value * other_value, 1]
+            else:
+                entry[0] += value * other_value
+                entry[1] += 1
+    norm = norms.get(book, 0.0)
+    scores = {}
+    for other, (dot, both) in acc.items():
+        denominator = norm * norms.get(other, 0.0)
+        if denominator > 0:
+            scores[other] = dot / denominator * both / (both + SHRINK)
+    return scores
+
+
+def _index(rows):
+    by_book, by_user, squares = defaultdict(list), defaultdict(list), defaultdict(float)
+    for user, book, value in rows:
+        by_book[book].append((user, value))
+        by_user[user].append((book, value))
+        squares[book] += value * value
+    return by_book, by_user, {book: math.sqrt(total) for book, total in squares.items()}
+
+
+def _write(c, book, neighbors):
+    c.execute("DELETE FROM book_neighbors WHERE bookID = ?", (book,))
+    c.executemany("INSERT INTO book_neighbors (bookID, rank, neighborID, score) VALUES (?, ?, ?, ?)",
+                  [(book, rank, neighbor, score) for rank, (neighbor, score) in enumerate(neighbors, 1)])
+
+
+def _top_k_python(rows):
+    by_book, by_user, norms = _index(rows)
+    for book in sorted(by_book):
+        yield book, _top(_scores(book, by_book, by_user, norms))
+
+
+def _top_k_scipy(rows):
+    users = {user: i for i, user in enumerate(sorted({row[0] for row in rows}))}
+    books = sorted({row[1] for row in rows})
+    columns = {book: i for i, book in enumerate(books)}
+    u = np.fromiter((users[row[0]] for row in rows), dtype=np.int64, count=len(rows))
+    b = np.fromiter((columns[row[1]] for row in rows), dtype=np.int64, count=len(rows))
+    v = np.fromiter((row[2] for row in rows), dtype=np.float64, count=len(rows))
+    shape = (len(users), len(books))
+
+    ratings = sparse.csr_matrix((v, (u, b)), shape=shape)
+    rated = sparse.csr_matrix((np.ones_like(v), (u, b)), shape=shape)
+    dots = (ratings.T @ ratings).tocsr()
+    both = (rated.T @ rated).tocsr()
+
+    norms = np.sqrt(np.asarray(ratings.multiply(ratings).sum(axis=0)).ravel())
+    inverse = np.divide(1.0, norms, out=np.zeros_like(norms), where=norms > 0)
+    shrink = both.copy()
+    shrink.data = shrink.data / (shrink.data + SHRINK)
+    similarity = sparse.diags(inverse) @ dots.multiply(shrink) @ sparse.diags(inverse)
+    similarity = similarity.tocsr()
+    similarity.setdiag(0)
+    similarity.eliminate_zeros()
+
+    ids = np.asarray(books)
+    for row in range(len(books)):
+        start, end = similarity.indptr[row], similarity.indptr[row + 1]
+        scores, neighbors = similarity.data[start:end], ids[similarity.indices[start:end]]
+        keep = scores > 0
+        scores, neighbors = scores[keep], neighbors[keep]
+        order = np.lexsort((neighbors, -scores))[:TOP_K]
+        yield books[row], [(int(neighbors[i]), float(scores[i])) for i in order]
+
+
+def rebuild(c, vectorized=None):
+    # recomputes every book's neighbors; returns the number of books with any.
+    # vectorized=None uses scipy when it is installed
+    if vectorized is None:
+        vectorized = sparse is not None
+    rows = _ratings(c)
+    c.execute("DELETE FROM book_neighbors")
+    c.execute("DELETE FROM recommend_dirty")
+    top_k = _top_k_scipy if vectorized and rows else _top_k_python
+    count = 0
+    for book, neighbors in top_k(rows):
+        if neighbors:
+            _write(c, book, neighbors)
+            count += 1
+    return count
+
+
+def refresh(c):
+    # recomputes the books marked dirty since the last refresh; returns how many
+    c.execute("SELECT bookID FROM recommend_dirty")
+    dirty = [row[0] for row in c.fetchall()]
+    if not dirty:
+        return 0
+    c.execute("DELETE FROM recommend_dirty")
+
+    # every score involving a dirty book comes from the readers of that book,
+    # so their ratings (and the norms of the books they rated) are all we need
+    readers = {row[0] for row in _ratings(c, 'bookID', dirty)}
+    rows = _ratings(c, 'userID', readers)
+    others = {row[1] for row in rows}
+    norm_rows = _ratings(c, 'bookID', others)
+    by_book, by_user, _ = _index(rows)
+    _, _, norms = _index(norm_rows)
+
+    for book in dirty:
+        scores = _scores(book, by_book, by_user, norms) if book in by_book else {}
+        _write(c, book, _top(scores))
+
+        # patch the dirty book's new score into the lists that mention it, or
+        # could now include it
+        c.execute("SELECT bookID FROM book_neighbors WHERE neighborID = ?", (book,))
+        affected = {row[0] for row in c.fetchall()} | set(scores)
+        for other in affected:
+            c.execute("SELECT neighborID, score FROM book_neighbors WHERE bookID = ?", (other,))
+            before = dict(c.fetchall())
+            current = dict(before)
+            current.pop(book, None)
+            if scores.get(other, 0.0) > 0:
+                current[book] = scores[other]
+            neighbors = _top(current)
+            if neighbors != _top(before):
+                _write(c, other, neighbors)
+    return len(dirty)
+
+
+SIMILAR_QUERY = '''SELECT N.neighborID, S.book_name, S.author_name, S.genre_name, S.avg_rating, S.num_rating, N.score
+                   FROM book_neighbors N JOIN book_search S ON S.bookID = N.neighborID
+                   WHERE N.bookID = ? ORDER BY N.rank LIMIT ?'''
+
+# sums the similarity of each candidate to the books the user liked, weighted
+# by how much they liked them; books the user already reviewed are left out
+RECOMMEND_QUERY = f'''SELECT N.neighborID, S.book_name, S.author_name, S.genre_name, S.avg_rating, S.num_rating,
+                             SUM(N.score * (R.rating - {NEUTRAL})) AS score
+                      FROM reviews R JOIN book_neighbors N ON N.bookID = R.bookID
+                      JOIN book_search S ON S.bookID = N.neighborID
+                      WHERE R.userID = ? AND R.rating > {NEUTRAL}
+                        AND N.neighborID NOT IN (SELECT bookID FROM reviews WHERE userID = ? AND bookID IS NOT NULL)
+                      GROUP BY N.neighborID ORDER BY score DESC, N.neighborID LIMIT ?'''
+
+
+def similar_books(c, book_id, limit):
+    c.execute(SIMILAR_QUERY, (book_id, limit))
+    return c.fetchall()
+
+
+def recommendations(c, user_id, limit):
+    c.execute(RECOMMEND_QUERY, (user_id, user_id, limit))
+    return c.fetchall()
+
+
+class Refresher:
+    # background thread running refresh() every interval seconds
+    def __init__(self, get_pool, interval=60.0, log=print):
+        self.get_pool = get_pool
+        self.interval = interval
+        self.log = log
+        self._stop = threading.Event()
+        self._thread = None
+        self._stats = {"refreshes": 0, "books_refreshed": 0, "last_refresh_seconds": 0.0, "errors": 0}
+
+    def run_once(self):
+        start = time.perf_counter()
+        with self.get_pool().transaction(write=True) as c:
+            count = refresh(c)
+        self._stats["refreshes"] += 1
+        self._stats["books_refreshed"] += count
+        self._stats["last_refresh_seconds"] = time.perf_counter() - start
+        return count
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.run_once()
+            except Exception as e:
+                self._stats["errors"] += 1
+                if self.log:
+                    self.log(f"recommendation refresh failed: {e}")
+
+    def start(self):
+        if self.interval > 0 and self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='recommend-refresh', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def metrics(self):
+        return dict(self._stats)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Build or refresh the book_neighbors similarity table.")
+    parser.add_argument('command', choices=['rebuild', 'refresh'])
+    parser.add_argument('--db', default='backend/database.db')
+    parser.add_argument('--python', action='store_true', help="don't use numpy/scipy even if installed")
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db, isolation_level=None)
+    c = conn.cursor()
+    c.execute("BEGIN IMMEDIATE")
+    ensure_recommendations(c)
+    start = time.perf_counter()
+    if args.command == 'rebuild':
+        count = rebuild(c, vectorized=False if args.python else None)
+        print(f"built neighbors for {count} books in {time.perf_counter() - start:.2f}s")
+    else:
+        count = refresh(c)
+        print(f"refreshed {count} books in {time.perf_counter() - start:.2f}s")
+    c.execute("COMMIT")
+    conn.close()
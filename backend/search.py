@@ -0,0 +1,186 @@
+import argparse
+import html
+import re
+import sqlite3
+
+# full-text search over the catalog with sqlite's FTS5. books_fts holds each
+# book's title, synopsis and author name (rowid = bookID), reviews_fts holds the
+# review text (rowid = reviewID). triggers on books, authors and reviews keep both
+# in step with the existing POST/PUT/DELETE routes, including an author added
+# or renumbered after the books that point at it.
+#
+# highlighted fields are HTML: sqlite marks matches with private-use characters,
+# the text is escaped, and only then do the markers become HIGHLIGHT_OPEN/CLOSE,
+# so stored titles and reviews can't carry markup of their own into a page.
+
+HIGHLIGHT_OPEN = '<mark>'
+HIGHLIGHT_CLOSE = '</mark>'
+_MARK_OPEN = '\ue000'
+_MARK_CLOSE = '\ue001'
+SNIPPET_TOKENS = 16
+
+# bm25 column weights for books_fts: a title hit counts most, then the author
+BOOK_WEIGHTS = (10.0, 1.0, 5.0)
+
+SEARCH_SCHEMA = [
+    '''CREATE VIRTUAL TABLE IF NOT EXISTS books_fts USING fts5(
+            book_name, synopsis, author_name,
+            tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3'
+       )''',
+    '''CREATE VIRTUAL TABLE IF NOT EXISTS reviews_fts USING fts5(
+            review,
+            tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3'
+       )''',
+]
+
+_INSERT_BOOK = '''INSERT INTO books_fts (rowid, book_name, synopsis, author_name)
+            VALUES (NEW.bookID, NEW.book_name, NEW.synopsis,
+                    (SELECT author_name FROM authors WHERE authorID = NEW.authorID));'''
+
+SEARCH_TRIGGERS = [
+    f'''CREATE TRIGGER IF NOT EXISTS search_books_insert AFTER INSERT ON books
+        BEGIN
+            {_INSERT_BOOK}
+        END''',
+    f'''CREATE TRIGGER IF NOT EXISTS search_books_update AFTER UPDATE OF book_name, synopsis, authorID ON books
+        BEGIN
+            DELETE FROM books_fts WHERE rowid = OLD.bookID;
+            {_INSERT_BOOK}
+        END''',
+    '''CREATE TRIGGER IF NOT EXISTS search_books_delete AFTER DELETE ON books
+        BEGIN
+            DELETE FROM books_fts WHERE rowid = OLD.bookID;
+        END''',
+    '''CREATE TRIGGER IF NOT EXISTS search_authors_insert AFTER INSERT ON authors
+        BEGIN
+            UPDATE books_fts SET author_name = NEW.author_name
+            WHERE rowid IN (SELECT bookID FROM books WHERE authorID = NEW.authorID);
+        END''',
+    '''CREATE TRIGGER IF NOT EXISTS search_authors_update AFTER UPDATE OF authorID, author_name ON authors
+        BEGIN
+            UPDATE books_fts SET author_name = NULL
+            WHERE NEW.authorID IS NOT OLD.authorID
+              AND rowid IN (SELECT bookID FROM books WHERE authorID = OLD.authorID);
+            UPDATE books_fts SET author_name = NEW.author_name
+            WHERE rowid IN (SELECT bookID FROM books WHERE authorID = NEW.authorID);
+        END''',
+    '''CREATE TRIGGER IF NOT EXISTS search_authors_delete AFTER DELETE ON authors
+        BEGIN
+            UPDATE books_fts SET author_name = NULL
+            WHERE rowid IN (SELECT bookID FROM books WHERE authorID = OLD.authorID);
+        END''',
+    '''CREATE TRIGGER IF NOT EXISTS search_reviews_insert AFTER INSERT ON reviews
+        BEGIN
+            INSERT INTO reviews_fts (rowid, review) VALUES (NEW.reviewID, NEW.review);
+        END''',
+    '''CREATE TRIGGER IF NOT EXISTS search_reviews_update AFTER UPDATE OF review ON reviews
+        BEGIN
+            DELETE FROM reviews_fts WHERE rowid = OLD.reviewID;
+            INSERT INTO reviews_fts (rowid, review) VALUES (NEW.reviewID, NEW.review);
+        END''',
+    '''CREATE TRIGGER IF NOT EXISTS search_reviews_delete AFTER DELETE ON reviews
+        BEGIN
+            DELETE FROM reviews_fts WHERE rowid = OLD.reviewID;
+        END''',
+]
+
+
+def ensure_search_index(c):
+    # creates the FTS tables and triggers; backfills when the tables are new
+    c.execute("SELECT 1 FROM sqlite_master WHERE name = 'books_fts'")
+    existed = c.fetchone() is not None
+    for statement in SEARCH_SCHEMA + SEARCH_TRIGGERS:
+        c.execute(statement)
+    if not existed:
+        rebuild_search_index(c)
+
+
+def update_author_triggers(c):
+    # databases indexed before the author insert/renumber triggers existed
+    c.execute("DROP TRIGGER IF EXISTS search_authors_update")
+    for statement in SEARCH_TRIGGERS:
+        c.execute(statement)
+    c.execute('''UPDATE books_fts SET author_name =
+                     (SELECT A.author_name FROM books B JOIN authors A ON A.authorID = B.authorID
+                      WHERE B.bookID = books_fts.rowid)''')
+
+
+def rebuild_search_index(c):
+    c.execute("DELETE FROM books_fts")
+    c.execute('''INSERT INTO books_fts (rowid, book_name, synopsis, author_name)
+                 SELECT B.bookID, B.book_name, B.synopsis, A.author_name
+                 FROM books B LEFT JOIN authors A ON A.authorID = B.authorID''')
+    books = c.rowcount
+    c.execute("DELETE FROM reviews_fts")
+    c.execute("INSERT INTO reviews_fts (rowid, review) SELECT reviewID, review FROM reviews")
+    reviews = c.rowcount
+    c.execute("INSERT INTO books_fts (books_fts) VALUES ('optimize')")
+    c.execute("INSERT INTO reviews_fts (reviews_fts) VALUES ('optimize')")
+    return books, reviews
+
+
+def match_query(text):
+    # turns free text into an FTS5 query: every word must match, each as a prefix.
+    # words are quoted so user input can't inject FTS syntax
+    words = re.findall(r'\w+', text)
+    if not words:
+        raise ValueError("Search query must contain at least one word")
+    return ' '.join('"' + word + '"*' for word in words)
+
+
+def _markup(text):
+    if text is None:
+        return None
+    return html.escape(text).replace(_MARK_OPEN, HIGHLIGHT_OPEN).replace(_MARK_CLOSE, HIGHLIGHT_CLOSE)
+
+
+def search_books(c, match, limit):
+    # rows: [bookID, book_name, author_name, genre_name, synopsis snippet, score].
+    # book_name, author_name and the snippet are escaped HTML with matches
+    # wrapped in HIGHLIGHT_OPEN/CLOSE; lower score is a better match
+    c.execute(f'''SELECT F.rowid,
+                    highlight(books_fts, 0, ?, ?),
+                    highlight(books_fts, 2, ?, ?),
+                    G.genre_name,
+                    snippet(books_fts, 1, ?, ?, '…', {SNIPPET_TOKENS}),
+                    bm25(books_fts, {', '.join(map(str, BOOK_WEIGHTS))}) AS score
+                  FROM books_fts F
+                  JOIN books B ON B.bookID = F.rowid
+                  LEFT JOIN genres G ON G.genreID = B.genreID
+                  WHERE books_fts MATCH ?
+                  ORDER BY score LIMIT ?''',
+              (_MARK_OPEN, _MARK_CLOSE) * 3 + (match, limit))
+    return [[row[0], _markup(row[1]), _markup(row[2]), row[3], _markup(row[4]), row[5]]
+            for row in c.fetchall()]
+
+
+def search_reviews(c, match, limit):
+    # rows: [reviewID, username, book_name, rating, review snippet, score]; only
+    # the snippet is HTML
+    c.execute(f'''SELECT F.rowid, U.username, B.book_name, R.rating,
+                    snippet(reviews_fts, 0, ?, ?, '…', {SNIPPET_TOKENS}),
+                    bm25(reviews_fts) AS score
+                  FROM reviews_fts F
+                  JOIN reviews R ON R.reviewID = F.rowid
+                  LEFT JOIN users U ON U.userID = R.userID
+                  LEFT JOIN books B ON B.bookID = R.bookID
+                  WHERE reviews_fts MATCH ?
+                  ORDER BY score LIMIT ?''',
+              (_MARK_OPEN, _MARK_CLOSE, match, limit))
+    return [[row[0], row[1], row[2], row[3], _markup(row[4]), row[5]] for row in c.fetchall()]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Rebuild the full-text search index.")
+    parser.add_argument('command', choices=['rebuild'])
+    parser.add_argument('--db', default='backend/database.db')
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db, isolation_level=None)
+    c = conn.cursor()
+    c.execute("BEGIN")
+    ensure_search_index(c)
+    books, reviews = rebuild_search_index(c)
+    c.execute("COMMIT")
+    conn.close()
+    print(f"indexed {books} books and {reviews} reviews")
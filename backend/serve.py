@@ -0,0 +1,53 @@
+import argparse
+import os
+import sys
+
+# production launcher: serves asgi.app with uvicorn across several worker
+# processes. run from the repository root so the database path resolves:
+#
+#   pip install uvicorn
+#   python backend/serve.py --workers 4 --port 5001
+#
+# which is the same as
+#
+#   ASGI_WORKERS=4 uvicorn asgi:app --app-dir backend --workers 4 --port 5001
+#
+# "python backend/main.py" is still the single-process development server.
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve the PlantYourBooks API over ASGI.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5001)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--threads', type=int, help="SQLite worker threads per process (default: pool size)")
+    parser.add_argument('--max-pending', type=int, help="requests allowed to wait for a thread before 503s")
+    args = parser.parse_args(argv)
+
+    try:
+        import uvicorn
+    except ImportError:
+        sys.exit("uvicorn is required for ASGI serving: pip install uvicorn")
+
+    # migrate once here, before any worker opens the database: switching an
+    # existing file to WAL needs it to ourselves
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from main import pool
+    from migrations import migrate
+    with pool.connection() as conn:
+        migrate(conn)
+    pool.close_all()
+
+    # the workers are spawned processes, so settings travel in the environment
+    os.environ['ASGI_WORKERS'] = str(args.workers)
+    if args.threads:
+        os.environ['ASGI_THREADS'] = str(args.threads)
+    if args.max_pending:
+        os.environ['ASGI_MAX_PENDING'] = str(args.max_pending)
+
+    uvicorn.run('asgi:app', app_dir=os.path.dirname(os.path.abspath(__file__)),
+                host=args.host, port=args.port, workers=args.workers, lifespan='on')
+
+
+if __name__ == '__main__':
+    main()
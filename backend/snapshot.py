@@ -0,0 +1,150 @@
+import argparse
+import os
+import sqlite3
+import threading
+import time
+from db import ConnectionPool
+
+# a separate place for analytics and exports to read from, so a long export
+# never holds one of the main pool's connections while writers wait for it.
+#
+#   off     exports read from the main pool, as everything else does
+#   wal     a second, query_only pool on the live database file. in WAL mode
+#           readers never block writers, so this only keeps exports out of the
+#           main pool; the data is always current
+#   backup  a copy of the database made with sqlite's online backup API every
+#           interval seconds, read through its own query_only pool. exports see
+#           data up to interval seconds old and never touch the live file
+#
+# the copy is written to a temporary file and moved over path in one rename,
+# then the read pool is recycled, so a query never sees a half-written copy.
+# it is kept in rollback-journal mode: WAL side files are found by name and
+# would be shared between the old and new copy while both are open.
+
+MODES = ('off', 'wal', 'backup')
+
+READ_CONNECTIONS = 4
+
+
+class Snapshot:
+    def __init__(self, get_pool, mode='wal', path=None, interval=300.0, log=print):
+        if mode not in MODES:
+            raise ValueError(f"snapshot mode must be one of {', '.join(MODES)}")
+        self.get_pool = get_pool
+        self.mode = mode
+        self.path = path
+        self.interval = interval
+        self.log = log
+        self._read_pool = None
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._taken = None
+        self._stats = {"refreshes": 0, "last_refresh_seconds": 0.0, "errors": 0}
+
+    def snapshot_path(self):
+        if self.path is not None:
+            return self.path
+        root, _ = os.path.splitext(self.get_pool().db_file)
+        return root + '.snapshot.db'
+
+    def pool(self):
+        # the pool exports should read from. in backup mode that is the live
+        # pool until the first copy has been taken
+        if self.mode == 'off' or (self.mode == 'backup' and self._taken is None):
+            return self.get_pool()
+        with self._lock:
+            if self._read_pool is None:
+                if self.mode == 'wal':
+                    self._read_pool = ConnectionPool(self.get_pool().db_file, max_connections=READ_CONNECTIONS,
+                                                     query_only=True)
+                else:
+                    self._read_pool = ConnectionPool(self.snapshot_path(), max_connections=READ_CONNECTIONS,
+                                                     journal_mode='DELETE', query_only=True)
+            return self._read_pool
+
+    def refresh(self):
+        # copies the live database over the snapshot; returns the seconds it took.
+        # a no-op outside backup mode
+        if self.mode != 'backup':
+            return 0.0
+        with self._refresh_lock:
+            start = time.perf_counter()
+            path = self.snapshot_path()
+            # one temporary file per process, as every ASGI worker refreshes its own copy
+            temporary = f"{path}.{os.getpid()}.tmp"
+            if os.path.exists(temporary):
+                os.remove(temporary)
+
+            taken = time.time()
+            source = sqlite3.connect(self.get_pool().db_file)
+            target = sqlite3.connect(temporary)
+            try:
+                # the whole copy in one step reads from a single snapshot of the
+                # source; copying in slices would restart whenever a writer commits
+                source.backup(target)
+                target.execute("PRAGMA journal_mode = DELETE")
+            finally:
+                target.close()
+                source.close()
+            os.replace(temporary, path)
+
+            if self._read_pool is not None:
+                self._read_pool.recycle()
+            self._taken = taken
+            self._stats["refreshes"] += 1
+            self._stats["last_refresh_seconds"] = time.perf_counter() - start
+            return self._stats["last_refresh_seconds"]
+
+    def _run(self):
+        # the first copy is taken straight away, then one every interval
+        while True:
+            try:
+                self.refresh()
+            except Exception as e:
+                self._stats["errors"] += 1
+                if self.log:
+                    self.log(f"snapshot refresh failed: {e}")
+            if self._stop.wait(self.interval):
+                return
+
+    def start(self):
+        if self.mode == 'backup' and self.interval > 0 and self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='snapshot-refresh', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        with self._lock:
+            if self._read_pool is not None:
+                self._read_pool.close_all()
+
+    def metrics(self):
+        stats = dict(self._stats)
+        stats["interval_seconds"] = self.interval if self.mode == 'backup' else 0.0
+        # how far behind the live database exports may be; -1 before the first copy
+        if self.mode != 'backup':
+            stats["staleness_seconds"] = 0.0
+        elif self._taken is None:
+            stats["staleness_seconds"] = -1.0
+        else:
+            stats["staleness_seconds"] = time.time() - self._taken
+        stats["last_refresh_seconds"] = round(stats["last_refresh_seconds"], 6)
+        if self._read_pool is not None:
+            stats["read_pool_in_use"] = self._read_pool.metrics()["in_use"]
+        return stats
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Take a read-only backup snapshot of the database.")
+    parser.add_argument('--db', default='backend/database.db')
+    parser.add_argument('--path', help="where to write the snapshot (default: next to the database)")
+    args = parser.parse_args()
+
+    snapshot = Snapshot(lambda: ConnectionPool(args.db), mode='backup', path=args.path)
+    seconds = snapshot.refresh()
+    print(f"wrote {snapshot.snapshot_path()} in {seconds:.2f}s")
@@ -0,0 +1,38 @@
+import json
+from itertools import chain
+from flask import Response, request
+
+# newline-delimited JSON for exports. rows go out in fetchmany batches as the
+# cursor produces them, so memory stays flat however big the table is and the
+# first rows reach the client while sqlite is still stepping through the rest.
+
+NDJSON = 'application/x-ndjson'
+BATCH_SIZE = 500
+
+
+def wants_ndjson():
+    # ?format=ndjson, or an Accept header that prefers ndjson over json
+    if request.args.get('format') == 'ndjson':
+        return True
+    return request.accept_mimetypes.best_match(['application/json', NDJSON]) == NDJSON
+
+
+def _generate(pool, query, args, batch_size):
+    with pool.transaction() as c:
+        c.execute(query, args)
+        while True:
+            rows = c.fetchmany(batch_size)
+            if not rows:
+                break
+            yield ''.join(json.dumps(row, separators=(',', ':')) + '\n' for row in rows)
+
+
+def ndjson_response(pool, query, args, batch_size=BATCH_SIZE):
+    rows = _generate(pool, query, args, batch_size)
+    # run the query and pull the first batch here so SQL errors still reach the
+    # route's error handling instead of failing after a 200 has gone out
+    try:
+        first = next(rows)
+    except StopIteration:
+        return Response('', mimetype=NDJSON)
+    return Response(chain([first], rows), mimetype=NDJSON)
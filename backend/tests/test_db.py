@@ -0,0 +1,44 @@
+import os
+import sys
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db import ConnectionPool
+
+
+def test_recycle_wakes_waiter(tmp_path):
+    # a connection discarded by recycle() frees its slot; a thread already
+    # waiting for one must open a new connection instead of timing out
+    pool = ConnectionPool(str(tmp_path / 'pool.db'), max_connections=1, timeout=5.0)
+    checked_out = threading.Event()
+    release = threading.Event()
+    got = []
+
+    def holder():
+        with pool.connection():
+            checked_out.set()
+            release.wait()
+
+    def waiter():
+        try:
+            with pool.connection() as conn:
+                got.append(conn.execute("SELECT 1").fetchone()[0])
+        except Exception as e:
+            got.append(e)
+
+    holding = threading.Thread(target=holder)
+    holding.start()
+    checked_out.wait()
+    waiting = threading.Thread(target=waiter)
+    waiting.start()
+    while pool.metrics()["waits"] == 0:
+        waiting.join(0.01)
+
+    pool.recycle()
+    release.set()
+    holding.join()
+    waiting.join(2.0)
+    assert not waiting.is_alive()
+    assert got == [1]
+    pool.close_all()